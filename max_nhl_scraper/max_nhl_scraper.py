@@ -6,7 +6,38 @@ import requests
 from bs4 import BeautifulSoup
 from datetime import datetime 
 import warnings
-from typing import Dict, Union
+import os
+import pickle
+import functools
+import itertools
+import hashlib
+import json
+import zlib
+import sqlite3
+import threading
+import queue
+import time
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from typing import Dict, List, Union
+
+try:
+    import zstandard
+except ImportError: # Optional, the payload archive falls back to zlib
+    zstandard = None
+
+try:
+    import orjson
+except ImportError: # Optional, JSON payloads are decoded with the json module otherwise
+    orjson = None
+
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+try:
+    import pyarrow
+except ImportError: # Optional, derived results are cached as pickles otherwise
+    pyarrow = None
 
 warnings.filterwarnings('ignore')
 
@@ -22,14 +53,61 @@ SHIFT_REPORT_AWAY_ENDPOINT = 'http://www.nhl.com/scores/htmlreports/{season}/TV{
 
 SHIFT_API_ENDPOINT = f"https://api.nhle.com/stats/rest/en/shiftcharts?cayenneExp=gameId={{game_id}}"
 
+# Number of URLs whose validators and parsed payload are kept for conditional requests (fetch_json(conditional=True))
+CONDITIONAL_CACHE_SIZE = 256
+
+# Version of the processing, part of the derived-result cache keys. Bump it when a change alters
+# the results of scrape_game, players_toi_per_strength, get_strength_toi_per_team or game_toi_partials
+PIPELINE_VERSION = '2'
+
+# Number of play-by-play payloads whose flattened plays (see plays_table) are kept
+PLAYS_CACHE_SIZE = 8
+
+# Fields of each play extracted by plays_table, as {parent}.{field} like pd.json_normalize would name them
+PLAY_FIELDS = ['eventId', 'period', 'timeInPeriod', 'timeRemaining', 'situationCode', 'homeTeamDefendingSide', 'typeCode',
+               'typeDescKey', 'sortOrder', 'periodDescriptor.number', 'periodDescriptor.periodType',
+               'details.eventOwnerTeamId', 'details.losingPlayerId', 'details.winningPlayerId', 'details.xCoord', 'details.yCoord',
+               'details.zoneCode', 'details.hittingPlayerId', 'details.hitteePlayerId', 'details.reason', 'details.secondaryReason',
+               'details.playerId', 'details.shotType', 'details.shootingPlayerId', 'details.goalieInNetId', 'details.awaySOG',
+               'details.homeSOG', 'details.blockingPlayerId', 'details.scoringPlayerId', 'details.assist1PlayerId',
+               'details.assist2PlayerId', 'details.awayScore', 'details.homeScore', 'details.typeCode', 'details.descKey',
+               'details.duration', 'details.committedByPlayerId', 'details.drawnByPlayerId', 'details.servedByPlayerId']
+
 
 DEFAULT_SEASON = 20232024
 DEFAULT_TEAM = "MTL"
 
+TEAM_ABBREVIATIONS = ['ANA', 'ARI', 'BOS', 'BUF', 'CAR', 'CBJ', 'CGY', 'CHI', 'COL', 'DAL', 'DET', 'EDM', 'FLA', 'LAK', 'MIN', 'MTL',
+                      'NJD', 'NSH', 'NYI', 'NYR', 'OTT', 'PHI', 'PIT', 'SEA', 'SJS', 'STL', 'TBL', 'TOR', 'VAN', 'VGK', 'WPG', 'WSH']
+
+SKATER_POSITIONS = ['C', 'D', 'L', 'R']
+
+FINISHED_GAME_STATES = ['OFF', 'FINAL']
+
+# Preference order of fetch_shifts(source="auto")
+SHIFT_SOURCES = ['html', 'api']
+
+# Data-quality checks of game_anomalies
+ANOMALY_CHECKS = ['too_many_players', 'too_few_skaters', 'missing_goalie', 'overlapping_shift', 'negative_duration']
+
+# Amount of work done by scrape_game, see its profile parameter
+SCRAPE_PROFILES = ['events', 'on_ice', 'full']
+
 NUMERICAL_COLUMNS = ['period', 'xCoord', 'yCoord', 'awayScore', 'homeScore', 'awaySOG','homeSOG', 'duration', 'event_player1_id', 'event_player2_id', 'event_player3_id', 'opposing_goalie_id', "game_id"]
 
 CATEGORICAL_COLUMNS = ['homeTeamDefendingSide', 'typeDescKey', 'periodType',  'zoneCode', 'reason', 'shotType',  'typeCode', 'descKey', 'secondaryReason', "gameType", "venue", "season"]
 
+# Units of line_combinations: positions and number of players
+LINE_UNITS = {'F': (['C', 'L', 'R'], 3), 'D': (['D'], 2)}
+
+# Codes of the position and shift start type fields of GameShifts
+POSITION_CODES = ['C', 'D', 'L', 'R', 'G']
+SHIFT_START_TYPES = ['OTF', 'NZF', 'OZF', 'DZF']
+
+#Strength states: code = skaters * (MAX_SKATERS + 1) + opponents, '0v0' is treated as missing
+MAX_SKATERS = 6
+STRENGTH_STATES = [f"{skaters}v{opponents}" for skaters in range(MAX_SKATERS + 1) for opponents in range(MAX_SKATERS + 1)]
+
 def filter_players(players, side):
     if side is not None:
         side = side.lower()
@@ -37,6 +115,169 @@ def filter_players(players, side):
         players = players.query(filter_condition)
     return players
 
+def strength_state(skaters, opponents) -> pd.Categorical:
+    '''
+    Encode skater counts as a strength state ('5v5', '5v4', '6v5', ...) with the fixed STRENGTH_STATES vocabulary.
+
+    Args:
+      skaters: Array-like of skater counts for the reference team.
+      opponents: Array-like of skater counts for the other team.
+
+    Returns:
+      A pandas Categorical (int8 codes). 0v0, missing counts and counts above MAX_SKATERS are missing.
+    '''
+    skaters = pd.to_numeric(pd.Series(np.asarray(skaters)), errors='coerce').fillna(-1).to_numpy(dtype=np.int64)
+    opponents = pd.to_numeric(pd.Series(np.asarray(opponents)), errors='coerce').fillna(-1).to_numpy(dtype=np.int64)
+
+    valid = ((skaters >= 0) & (skaters <= MAX_SKATERS) & (opponents >= 0) & (opponents <= MAX_SKATERS)
+             & ((skaters + opponents) > 0))
+    codes = np.where(valid, skaters * (MAX_SKATERS + 1) + opponents, -1)
+
+    return pd.Categorical.from_codes(codes, categories=STRENGTH_STATES)
+
+def shift_occupancy(codes, start, end, n_seconds):
+    '''
+    Per-second occupancy grid: result[p, s] is True while player code p is on the ice during second s (start <= s < end).
+    Shifts with end <= start are ignored.
+    '''
+    codes, start, end = np.asarray(codes), np.asarray(start, dtype=np.int64), np.asarray(end, dtype=np.int64)
+    n_players = int(codes.max()) + 1 if len(codes) else 0
+
+    forward = start < end
+    occupancy = np.zeros((n_players, n_seconds + 1), dtype=np.int16)
+    np.add.at(occupancy, (codes[forward], np.clip(start[forward], 0, n_seconds)), 1)
+    np.add.at(occupancy, (codes[forward], np.clip(end[forward], 0, n_seconds)), -1)
+
+    return occupancy.cumsum(axis=1)[:, :n_seconds] > 0
+
+def _state_one_hot(state: pd.Categorical) -> np.ndarray:
+    # One-hot (seconds, STRENGTH_STATES) of the strength state of every second, so player seconds per state is one matrix product
+    seconds_per_state = np.zeros((len(state), len(STRENGTH_STATES)), dtype=np.int32)
+    seconds_per_state[np.flatnonzero(state.codes >= 0), state.codes[state.codes >= 0]] = 1
+    return seconds_per_state
+
+_GAME_SHIFTS_DTYPE = np.dtype([('player', '<i2'), ('playerId', '<i4'), ('is_home', 'i1'), ('position', 'i1'), ('period', 'i1'),
+                               ('type', 'i1'), ('start_s', '<i2'), ('end_s', '<i2'), ('duration_s', '<i2')])
+
+_GAME_SHIFTS_PLAYER_COLUMNS = ['fullName', 'sweaterNumber', 'positionCode', 'abbrev']
+
+class GameShifts:
+    '''
+    Compact shifts of one game: a numpy structured array with one record per shift (player code, playerId,
+    is_home, position and shift type codes, period, start_s, end_s, duration_s as small ints) in the order
+    of the source dataframe, and a players table with one row per player (is_home, playerId, fullName,
+    sweaterNumber, positionCode, abbrev) indexed by the player code.
+
+    on_ice_long, on_ice_at, game_toi_partials and game_anomalies accept it wherever they accept a shifts dataframe.
+
+    Parameters
+    ----------
+    shifts : np.ndarray
+        Records with the _GAME_SHIFTS_DTYPE fields.
+    players : pd.DataFrame
+        Player table, row i describes player code i.
+    game_id : int, optional
+        Game ID. The default is None.
+    '''
+
+    __slots__ = ('shifts', 'players', 'game_id')
+
+    def __init__(self, shifts: np.ndarray, players: pd.DataFrame, game_id: Union[int, None] = None):
+        self.shifts = shifts
+        self.players = players
+        self.game_id = game_id
+
+    @classmethod
+    def from_frame(cls, shifts_df: pd.DataFrame) -> 'GameShifts':
+        '''Build from a shifts dataframe (fetch_shifts, fetch_html_shifts2 or fetch_api_shifts).'''
+        codes, keys = pd.factorize(pd.MultiIndex.from_arrays([shifts_df['is_home'].astype(int), shifts_df['playerId'].astype(np.int64)]))
+
+        shifts = np.zeros(len(shifts_df), dtype=_GAME_SHIFTS_DTYPE)
+        shifts['player'] = codes
+        shifts['playerId'] = shifts_df['playerId'].to_numpy()
+        shifts['is_home'] = shifts_df['is_home'].to_numpy()
+        shifts['position'] = pd.Categorical(shifts_df['positionCode'], categories=POSITION_CODES).codes if 'positionCode' in shifts_df else -1
+        shifts['period'] = shifts_df['period'].to_numpy()
+        shifts['type'] = pd.Categorical(shifts_df['type'], categories=SHIFT_START_TYPES).codes if 'type' in shifts_df else -1
+        shifts['start_s'] = shifts_df['startTime_s'].to_numpy()
+        shifts['end_s'] = shifts_df['endTime_s'].to_numpy()
+        shifts['duration_s'] = shifts_df['duration_s'].to_numpy()
+
+        first = pd.Series(np.arange(len(codes))).groupby(codes).first().to_numpy()
+        players = pd.DataFrame({'is_home': np.asarray(keys.get_level_values(0)) if len(keys) else np.zeros(0, dtype=int),
+                                'playerId': np.asarray(keys.get_level_values(1)) if len(keys) else np.zeros(0, dtype=np.int64)})
+        source = shifts_df.rename(columns={'teamAbbrev': 'abbrev'}) if 'abbrev' not in shifts_df else shifts_df
+        for column in _GAME_SHIFTS_PLAYER_COLUMNS:
+            if column in source.columns:
+                players[column] = source[column].to_numpy()[first]
+
+        game_id = int(shifts_df['game_id'].iloc[0]) if 'game_id' in shifts_df and len(shifts_df) else None
+        return cls(shifts, players, game_id)
+
+    def __len__(self):
+        return len(self.shifts)
+
+    def to_frame(self) -> pd.DataFrame:
+        '''Shifts as a dataframe with the fetch_shifts column names, in the order of the source dataframe.'''
+        shifts = self.shifts
+        df = pd.DataFrame({'playerId': shifts['playerId'].astype(np.int64),
+                           'is_home': shifts['is_home'].astype(np.int64),
+                           'period': shifts['period'].astype(np.int64),
+                           'startTime_s': shifts['start_s'].astype(np.int64),
+                           'endTime_s': shifts['end_s'].astype(np.int64),
+                           'duration_s': shifts['duration_s'].astype(np.int64),
+                           'type': pd.Categorical.from_codes(shifts['type'], categories=SHIFT_START_TYPES).astype(object)})
+        players = self.players.iloc[shifts['player']]
+        for column in _GAME_SHIFTS_PLAYER_COLUMNS:
+            if column in players.columns:
+                df[column] = players[column].to_numpy()
+        df['game_id'] = self.game_id
+        return df
+
+def _shift_arrays(shifts, places=('home', 'away'), positive_only=True, positions=None, with_period=False):
+    # Shift arrays of a dataframe or GameShifts: player codes in order of first appearance (keys are (is_home, playerId)),
+    # start, end, and a per-code player table with the columns of _GAME_SHIFTS_PLAYER_COLUMNS that are available.
+    # with_period appends the period of every shift. Shifts keep the order of the source
+    is_home = [int(place == 'home') for place in places]
+    if isinstance(shifts, GameShifts):
+        records = shifts.shifts
+        mask = np.isin(records['is_home'], is_home)
+        if positive_only:
+            mask &= records['duration_s'] > 0
+        if positions is not None:
+            mask &= np.isin(records['position'], [POSITION_CODES.index(position) for position in positions])
+        records = records[mask]
+        player_codes, start, end = records['player'], records['start_s'].astype(np.int64), records['end_s'].astype(np.int64)
+        period = records['period'].astype(np.int64)
+        source = shifts.players
+    else:
+        shifts_df = shifts.query('duration_s > 0') if positive_only else shifts
+        shifts_df = shifts_df[shifts_df['is_home'].isin(is_home)]
+        if positions is not None:
+            shifts_df = shifts_df[shifts_df['positionCode'].isin(positions)]
+        player_codes, source = None, shifts_df.rename(columns={'teamAbbrev': 'abbrev'}) if 'abbrev' not in shifts_df else shifts_df
+        start, end = shifts_df['startTime_s'].to_numpy(dtype=np.int64), shifts_df['endTime_s'].to_numpy(dtype=np.int64)
+        period = shifts_df['period'].to_numpy(dtype=np.int64) if with_period else None
+        records = shifts_df
+
+    if player_codes is not None:
+        codes, order = pd.factorize(player_codes)
+        players = source.iloc[np.asarray(order)].reset_index(drop=True)
+    else:
+        codes = (pd.factorize(pd.MultiIndex.from_arrays([records['is_home'].astype(int), records['playerId']]))[0]
+                 if len(records) else np.zeros(0, dtype=np.int64))
+        first = pd.Series(np.arange(len(codes))).groupby(codes).first().to_numpy()
+        players = (source[['is_home', 'playerId'] + [column for column in _GAME_SHIFTS_PLAYER_COLUMNS if column in source.columns]]
+                   .iloc[first].reset_index(drop=True))
+        players['is_home'] = players['is_home'].astype(int)
+    return (codes, players, start, end, period) if with_period else (codes, players, start, end)
+
+def _team_mask(players, side):
+    # Players (of a _shift_arrays player table) of 'home', 'away' or a team abbreviation
+    if side in ('home', 'away'):
+        return players['is_home'].to_numpy() == int(side == 'home')
+    return players['abbrev'].to_numpy() == side
+
 def str_to_sec(value):
     # Split the time value into minutes and seconds
     minutes, seconds = value.split(':')
@@ -48,6 +289,11 @@ def str_to_sec(value):
     # Calculate the total seconds
     return minutes * 60 + seconds
 
+def clock_to_sec(clock: pd.Series) -> np.ndarray:
+    # Vectorized str_to_sec for a column of 'mm:ss' clocks
+    parts = clock.str.strip().str.split(':', n=1)
+    return parts.str[0].astype(np.int64).to_numpy() * 60 + parts.str[1].astype(np.int64).to_numpy()
+
 def format_df(df):
 
     #Column names
@@ -103,7 +349,7 @@ def format_columns(df):
     "details.scoringPlayerId", "details.assist1PlayerId",
     "details.assist2PlayerId", "details.committedByPlayerId",
     "details.drawnByPlayerId", "details.servedByPlayerId",
-    "situationCode", "typeCode", "sortOrder", "eventId", 'periodDescriptor.number']
+    "situationCode", "typeCode", "sortOrder", "eventId", 'periodDescriptor.number', 'details.eventOwnerTeamId']
 
     # Calculate the set difference to find missing columns
     columns_missing = set(cols) - set(df.columns)
@@ -158,6 +404,10 @@ def format_columns(df):
     # Renaming columns
     df.columns = [col.split('.')[-1] for col in df.columns]
 
+    # A subset of plays (e.g. the new plays of a live game) may not have every detail field
+    for column in set(NUMERICAL_COLUMNS + CATEGORICAL_COLUMNS) - set(df.columns):
+        df[column] = np.nan
+
     # Converting columns to appropriate data types
     df[NUMERICAL_COLUMNS] = df[NUMERICAL_COLUMNS].apply(pd.to_numeric, errors='coerce')
     df[CATEGORICAL_COLUMNS] = df[CATEGORICAL_COLUMNS].astype("category")
@@ -206,118 +456,521 @@ def add_event_players_info(df, rosters_df):
 
     return df
 
-def strength(df):
+def add_event_team(df, rosters_df):
+    # Light version of add_event_players_info: only event_team and is_home, with one lookup instead of four merges
+    teams = rosters_df.drop_duplicates('playerId').set_index('playerId')['abbrev']
+    df["event_team"] = df["event_player1_id"].map(teams)
+    df.rename(columns={"typeDescKey" : "event"}, inplace=True)
+    df["is_home"] = np.nan
+    df.loc[df["event_team"] == df["home_abbr"],"is_home"] = 1
+    df.loc[df["event_team"] == df["away_abbr"],"is_home"] = 0
+
+    return df
+
+def strength(df, on_ice=None):
 
     ### FIX GAME STRENGTH ###
 
     ### THIS EXEMPLE scrape_game(2023020069) HAS WRONG GAME STRENGTH FOR GAME VS CAPS (5V5 IN OT) ###
 
+    if on_ice is None:
+        df['home_skaters'] = (~df[['home_on_position_1', 'home_on_position_2', 'home_on_position_3', 'home_on_position_4', 'home_on_position_5', 'home_on_position_6', 'home_on_position_7']].isin(['G', np.nan])).sum(axis=1)
+        df['away_skaters'] = (~df[['away_on_position_1', 'away_on_position_2', 'away_on_position_3', 'away_on_position_4', 'away_on_position_5', 'away_on_position_6', 'away_on_position_7']].isin(['G', np.nan])).sum(axis=1)
+    else:
+        # Long on-ice table (see on_ice_long), must carry positionCode
+        skaters = on_ice[~on_ice['positionCode'].isin(['G', np.nan])]
+        counts = skaters.groupby(['event_idx', 'side'], observed=True).size().unstack('side', fill_value=0).reindex(columns=['home', 'away'], fill_value=0)
+        df['home_skaters'] = counts['home'].reindex(df.index, fill_value=0).to_numpy()
+        df['away_skaters'] = counts['away'].reindex(df.index, fill_value=0).to_numpy()
 
-    df['home_skaters'] = (~df[['home_on_position_1', 'home_on_position_2', 'home_on_position_3', 'home_on_position_4', 'home_on_position_5', 'home_on_position_6', 'home_on_position_7']].isin(['G', np.nan])).sum(axis=1)
-    df['away_skaters'] = (~df[['away_on_position_1', 'away_on_position_2', 'away_on_position_3', 'away_on_position_4', 'away_on_position_5', 'away_on_position_6', 'away_on_position_7']].isin(['G', np.nan])).sum(axis=1)
-
-    df["strength"] = np.where(df["event_team"] == df['home_abbr'], df['home_skaters'].astype(str) + 'v' + df['away_skaters'].astype(str), df['away_skaters'].astype(str) + 'v' + df['home_skaters'].astype(str))
+    df['home_skaters'] = df['home_skaters'].astype(np.int8)
+    df['away_skaters'] = df['away_skaters'].astype(np.int8)
 
-    df.strength.replace({'0v0': None}, inplace=True)
+    home_event = (df["event_team"] == df['home_abbr']).to_numpy()
+    df["strength"] = strength_state(np.where(home_event, df['home_skaters'], df['away_skaters']),
+                                    np.where(home_event, df['away_skaters'], df['home_skaters']))
 
 
     return df
 
 def process_pbp(pbp, shifts_df, rosters_df, is_home=True):
-    is_home = int(is_home)
-    # print(is_home)
-    place = 'home' if is_home else 'away'
+    '''
+    Adds the on-ice players of each event as {place}_on_id/name/position_1..7 columns.
 
-    # players = rosters_df.query("is_home==@is_home").set_index('sweaterNumber')['playerId'].to_dict()
-    # print(players)
-
-    shifts_df = shifts_df.query("is_home==@is_home").query('duration_s > 0').copy()
-    players_on = []
-
-    # print(shifts_df)
-    for _, row in pbp.iterrows():
-        current_time = row['elapsedTime']
-        if pd.isna(row['event_team']):
-            players_on.append(np.nan)
-        elif row['event'] == 'faceoff':
-            # current_time = row['elapsedTime']
-            # print(current_time)
-            players_on_ice = shifts_df.query('startTime_s == @current_time')['playerId'].unique().tolist()
-            
-            # players_on_ice_2 = [players.get(int(item), int(item)) for item in players_on_ice]
-            # print(players_on_ice)
-            players_on.append(players_on_ice)
-            
-        # elif row['event'] == 'goal':
-        #     players_on_ice = shifts_df.query('startTime_s < @current_time and endTime_s >= @current_time')['playerId'].unique().tolist()
-            
-        #     # players_on_ice_2 = [players.get(int(item), int(item)) for item in players_on_ice]
-        #     # print(players_on_ice)
-        #     players_on.append(players_on_ice)
+    Parameters
+    ----------
+    pbp : pd.DataFrame
+        Play-by-play dataframe.
+    shifts_df : pd.DataFrame
+        Shifts dataframe.
+    rosters_df : pd.DataFrame
+        Game rosters dataframe, for names and positions.
+    is_home : Union[bool, None], optional
+        True for the home team, False for the away team, None for both teams in a single pass. The default is True.
+    '''
+    side = None if is_home is None else ('home' if is_home else 'away')
+    on_ice = on_ice_long(pbp, shifts_df, rosters_df, side=side)
+    return on_ice_wide(pbp, on_ice, sides=None if side is None else [side])
 
-        else:
-            # current_time = row['elapsedTime']
-            # print(current_time)
-            # players_on_ice = shifts_df.query('startTime_s =< @current_time and endTime_s >= @current_time')['playerId'].unique().tolist()
-            players_on_ice = shifts_df.query('startTime_s < @current_time and endTime_s >= @current_time')['playerId'].unique().tolist()
-            # players_on_ice_2 = [players.get(int(item), int(item)) for item in players_on_ice]
-            # print(players_on_ice)
-            players_on.append(players_on_ice)
-            if len(players_on_ice) > 7:
-                print(row['game_id'],players_on_ice, current_time, row['event'])
-    
-    pbp[f'{place}_on'] = players_on
+def on_ice_wide(pbp, on_ice, sides=None, columns=None):
+    '''
+    Writes a long on-ice table (see on_ice_long) into pbp as {place}_on_id/name/position_1..n columns
+    (at least 7 slots per team). sides defaults to ['home', 'away'], columns to ['id', 'name', 'position'].
+    '''
+    sides = ['home', 'away'] if sides is None else sides
+    columns = ['id', 'name', 'position'] if columns is None else columns
+    positions = pd.Index(pbp.index).get_indexer(on_ice['event_idx'])
+    wide = {}
+    for place in sides:
+        side = (on_ice['side'] == place).to_numpy()
+        rows, slots = positions[side], on_ice['slot'].to_numpy()[side].astype(np.int64) - 1
+        n_slots = max(7, int(slots.max(initial=-1)) + 1)
+
+        for column, values, dtype in [('id', on_ice['playerId'], float),
+                                      ('name', on_ice.get('fullName'), object),
+                                      ('position', on_ice.get('positionCode'), object)]:
+            if column not in columns:
+                continue
+            grid = np.full((len(pbp), n_slots), np.nan, dtype=dtype)
+            if values is not None:
+                grid[rows, slots] = values.to_numpy()[side]
+            for i in range(n_slots):
+                wide[f'{place}_on_{column}_{i+1}'] = grid[:, i]
+
+    # Replace on-ice columns of a previous call, then add every new column in one concat
+    prefixes = tuple(f'{place}_on_' for place in sides)
+    pbp = pbp.drop(columns=[column for column in pbp.columns if column.startswith(prefixes)])
+
+    return pd.concat([pbp, pd.DataFrame(wide, index=pbp.index)], axis=1)
+
+def on_ice_long(pbp: pd.DataFrame, shifts_df: pd.DataFrame, rosters_df: Union[pd.DataFrame, None] = None, side: Union[str, None] = None) -> pd.DataFrame:
+    '''
+    Build a tidy on-ice table with one row per player on the ice for each event.
 
-    max_list_length = pbp[f'{place}_on'].apply(lambda x: len(x) if isinstance(x, list) else 0).max()
+    Same matching rules as process_pbp (players who started their shift at the faceoff time,
+    otherwise startTime_s < elapsedTime <= endTime_s), but resolved with array operations
+    on a per-second occupancy grid instead of one query per event.
+
+    Parameters
+    ----------
+    pbp : pd.DataFrame
+        Play-by-play dataframe with 'elapsedTime', 'event' and 'event_team' columns.
+    shifts_df : Union[pd.DataFrame, GameShifts]
+        Shifts dataframe (fetch_html_shifts2 or fetch_api_shifts) or GameShifts.
+    rosters_df : Union[pd.DataFrame, None], optional
+        Game rosters dataframe. When given, fullName, positionCode and sweaterNumber are joined. The default is None.
+    side : Union[str, None], optional
+        'home' or 'away' to resolve only one team. The default is None, meaning both.
+
+    Returns
+    -------
+    pd.DataFrame with columns game_id, event_idx, side, slot, playerId (event_idx is the pbp index label).
+    '''
 
-    for i in range(max_list_length):
-        pbp[f'{place}_on_id_{i+1}'] = np.nan
+    places = ['home', 'away'] if side is None else [side.lower()]
 
-    for index, row in pbp.iterrows():
-        values = row[f'{place}_on']
-        if isinstance(values, list):
-            for i, value in enumerate(values):
-                pbp.at[index, f'{place}_on_id_{i+1}'] = value
-                pbp.at[index, f'{place}_on_name_{i+1}'] = value
-                pbp.at[index, f'{place}_on_position_{i+1}'] = value
+    times = pd.to_numeric(pbp['elapsedTime'], errors='coerce').to_numpy(dtype=float)
+    has_team = pbp['event_team'].notna().to_numpy() & ~np.isnan(times)
+    is_faceoff = (pbp['event'] == 'faceoff').to_numpy() & has_team
+    is_other = has_team & ~is_faceoff
+    times = np.where(has_team, times, 0).astype(np.int64)
 
+    # One occupancy grid for both teams, players keyed by (is_home, playerId) in order of first appearance
+    codes, players, start, end = _shift_arrays(shifts_df, places)
+    n_seconds = int(max(end.max(initial=0), times.max(initial=0))) + 2
 
+    occupancy = shift_occupancy(codes, start, end, n_seconds)
 
-    pbp[f"{place}_on_id_7"] = np.nan if f"{place}_on_id_7" not in pbp.columns else pbp[f"{place}_on_id_7"]
+    started = np.zeros((len(players), n_seconds), dtype=bool)
+    started[codes, start] = True
 
-    pbp[f"{place}_on_name_1"], pbp[f"{place}_on_name_2"], pbp[f"{place}_on_name_3"], pbp[f"{place}_on_name_4"], pbp[f"{place}_on_name_5"], pbp[f"{place}_on_name_6"], pbp[f"{place}_on_name_7"] = pbp[f"{place}_on_id_1"], pbp[f"{place}_on_id_2"], pbp[f"{place}_on_id_3"], pbp[f"{place}_on_id_4"], pbp[f"{place}_on_id_5"], pbp[f"{place}_on_id_6"], pbp[f"{place}_on_id_7"]
+    on_ice = np.zeros((len(pbp), len(players)), dtype=bool)
+    other_rows = np.flatnonzero(is_other & (times > 0))
+    on_ice[other_rows] = occupancy[:, times[other_rows] - 1].T
+    faceoff_rows = np.flatnonzero(is_faceoff)
+    on_ice[faceoff_rows] = started[:, times[faceoff_rows]].T
 
-    players_id = rosters_df.query("is_home==@is_home").set_index('playerId')['fullName'].to_dict()
-    # Define the columns to be replaced
-    columns_to_replace = [f"{place}_on_name_1", f"{place}_on_name_2", f"{place}_on_name_3", f"{place}_on_name_4", f"{place}_on_name_5", f"{place}_on_name_6", f"{place}_on_name_7"]
+    player_is_home = players['is_home'].to_numpy()
+    player_ids = players['playerId'].to_numpy()
 
-    # Use the replace method to replace player IDs with names
-    pbp[columns_to_replace] = pbp[columns_to_replace].replace(players_id) 
+    frames = []
+    for place in places:
+        side_players = np.flatnonzero(player_is_home == int(place == 'home'))
+        event_pos, player_pos = np.nonzero(on_ice[:, side_players])
+        slot = np.arange(len(event_pos)) - np.searchsorted(event_pos, event_pos) + 1
 
+        frames.append(pd.DataFrame({'game_id': pbp['game_id'].to_numpy()[event_pos],
+                                    'event_idx': pbp.index.to_numpy()[event_pos],
+                                    'side': place,
+                                    'slot': slot.astype(np.int8),
+                                    'playerId': player_ids[side_players][player_pos]}))
 
+    long_df = pd.concat(frames, ignore_index=True)
 
-    pbp[f"{place}_on_position_1"], pbp[f"{place}_on_position_2"], pbp[f"{place}_on_position_3"], pbp[f"{place}_on_position_4"], pbp[f"{place}_on_position_5"], pbp[f"{place}_on_position_6"], pbp[f"{place}_on_position_7"] = pbp[f"{place}_on_id_1"], pbp[f"{place}_on_id_2"], pbp[f"{place}_on_id_3"], pbp[f"{place}_on_id_4"], pbp[f"{place}_on_id_5"], pbp[f"{place}_on_id_6"], pbp[f"{place}_on_id_7"]
+    if rosters_df is not None:
+        attributes = (rosters_df[['playerId', 'is_home', 'fullName', 'positionCode', 'sweaterNumber']]
+                      .assign(side=lambda x: np.where(x['is_home'] == 1, 'home', 'away'))
+                      .drop(columns=['is_home']))
+        long_df = long_df.merge(attributes, on=['side', 'playerId'], how='left')
 
-    players_id = rosters_df.query("is_home==@is_home").set_index('playerId')['positionCode'].to_dict()
-    # Define the columns to be replaced
-    columns_to_replace = [f"{place}_on_position_1", f"{place}_on_position_2", f"{place}_on_position_3", f"{place}_on_position_4", f"{place}_on_position_5", f"{place}_on_position_6", f"{place}_on_position_7"]
+    long_df['side'] = pd.Categorical(long_df['side'], categories=['home', 'away'])
 
-    # Use the replace method to replace player IDs with names
-    pbp[columns_to_replace] = pbp[columns_to_replace].replace(players_id) 
+    return long_df
 
-    pbp.drop([f"{place}_on"], axis=1, inplace=True)
-    pbp=pbp.loc[:, ~pbp.columns[::-1].duplicated()[::-1]]
+def on_ice_at(shifts_df: pd.DataFrame, times, side: Union[str, None] = None, closed: str = 'left', output: str = 'long'):
+    '''
+    Players on the ice (skaters and goalies) at arbitrary elapsed-second timestamps, in one vectorized lookup.
+
+    The shifts are laid out on the per-second occupancy grid (see shift_occupancy) once, then every
+    timestamp is a column lookup, so tens of thousands of timestamps cost about as much as one.
+
+    Parameters
+    ----------
+    shifts_df : Union[pd.DataFrame, GameShifts]
+        Shifts dataframe (fetch_shifts, fetch_html_shifts2 or fetch_api_shifts) or GameShifts.
+    times : array-like
+        Elapsed seconds since the start of the game, in any order. Floats are allowed, missing values
+        and times outside the game have nobody on the ice.
+    side : Union[str, None], optional
+        'home' or 'away' to resolve only one team. The default is None, meaning both.
+    closed : str, optional
+        'left' counts a player as on the ice for startTime_s <= t < endTime_s, 'right' for
+        startTime_s < t <= endTime_s, which is the rule used for non-faceoff plays in process_pbp. The default is 'left'.
+    output : str, optional
+        'long' for a tidy dataframe, 'array' for the boolean matrix. The default is 'long'.
+
+    Returns
+    -------
+    With output='long', a pd.DataFrame with one row per (timestamp, player) and columns time_idx (position in times),
+    time, side, slot, playerId, plus fullName and positionCode when shifts_df has them.
+    With output='array', a tuple (on_ice, players): on_ice is a (len(times), len(players)) boolean matrix and
+    players a dataframe with playerId, side (and fullName, positionCode) for its columns.
+    '''
+    if closed not in ('left', 'right'):
+        raise ValueError("closed must be 'left' or 'right'.")
+    places = ['home', 'away'] if side is None else [side.lower()]
+
+    codes, shift_players, start, end = _shift_arrays(shifts_df, places)
+    n_seconds = int(end.max(initial=0))
+    occupancy = shift_occupancy(codes, start, end, n_seconds)
+
+    # Second of the grid that decides each timestamp, -1 when nobody can be on the ice
+    times = np.asarray(times, dtype=float).ravel()
+    seconds = np.floor(times) if closed == 'left' else np.ceil(times) - 1
+    valid = ~np.isnan(seconds) & (seconds >= 0) & (seconds < n_seconds)
+    seconds = np.where(valid, seconds, 0).astype(np.int64)
+
+    on_ice = np.zeros((len(times), len(shift_players)), dtype=bool)
+    on_ice[valid] = occupancy[:, seconds[valid]].T
+
+    attributes = [column for column in ['fullName', 'positionCode'] if column in shift_players.columns]
+    players = pd.DataFrame({'playerId': shift_players['playerId'].to_numpy(),
+                            'side': pd.Categorical(np.where(shift_players['is_home'].to_numpy() == 1, 'home', 'away'), categories=['home', 'away'])})
+    for column in attributes:
+        players[column] = shift_players[column].to_numpy()
+
+    if output == 'array':
+        return on_ice, players
+
+    time_pos, player_pos = np.nonzero(on_ice)
+    # Slots are numbered per (timestamp, side); players are already grouped by side within a timestamp
+    side_codes = players['side'].cat.codes.to_numpy()[player_pos]
+    group = time_pos * 2 + side_codes
+    order = np.lexsort((player_pos, group))
+    time_pos, player_pos, group = time_pos[order], player_pos[order], group[order]
+    slot = np.arange(len(group)) - np.searchsorted(group, group) + 1
+
+    long_df = players.iloc[player_pos].reset_index(drop=True)
+    long_df['time_idx'] = time_pos
+    long_df['time'] = times[time_pos]
+    long_df['slot'] = slot.astype(np.int8)
+
+    return long_df[['time_idx', 'time', 'side', 'slot', 'playerId'] + attributes]
+
+def shift_changes(shifts: pd.DataFrame, team_column: str = 'abbrev') -> pd.DataFrame:
+    '''
+    Line changes of a game: the players going on and off the ice at every (team, period, clock time).
 
-    return pbp
+    Parameters
+    ----------
+    shifts : Union[pd.DataFrame, GameShifts]
+        Shifts with period, startTime_s, endTime_s (elapsed seconds), fullName and sweaterNumber,
+        e.g. fetch_shifts from either source or GameShifts.
+    team_column : str, optional
+        Column identifying the team of each shift. The default is 'abbrev'.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per change with team_column, period, time ('m:ss' period clock), on, on_numbers, number_on,
+        off, off_numbers, number_off (names and numbers joined with ', ', NaN when nobody goes on/off),
+        period_seconds and game_seconds, plus is_home when the shifts have it. Sorted by period and time.
+    '''
+    if isinstance(shifts, GameShifts):
+        # Player attributes come from the per-player table, indexed by the player code of every shift
+        codes, players, start, end, period = _shift_arrays(shifts, positive_only=False, with_period=True)
+        source, rows = players, codes
+    else:
+        # Plain dataframes may lack is_home and playerId (e.g. the legacy HTML shifts), read the columns as they are
+        period = shifts['period'].to_numpy().astype(np.int64)
+        start, end = shifts['startTime_s'].to_numpy().astype(np.int64), shifts['endTime_s'].to_numpy().astype(np.int64)
+        source, rows = shifts, np.arange(len(shifts))
+    offset = (period - 1) * 1200
+    numbers = source['sweaterNumber']
+    numbers = (numbers.astype('Int64').astype(str) if pd.api.types.is_numeric_dtype(numbers) else numbers.astype(str)).to_numpy()[rows]
+    teams = source[team_column].to_numpy()[rows]
+    base = pd.DataFrame({team_column: teams, 'period': period,
+                         'name': source['fullName'].to_numpy()[rows], 'number': numbers})
+
+    def changes(seconds, names, numbers, count):
+        return (base.assign(period_seconds=seconds)
+                    .groupby([team_column, 'period', 'period_seconds'])
+                    .agg(**{names: ('name', ', '.join), numbers: ('number', ', '.join), count: ('name', 'count')})
+                    .reset_index())
+
+    changes_on = changes(start - offset, 'on', 'on_numbers', 'number_on')
+    changes_off = changes(end - offset, 'off', 'off_numbers', 'number_off')
+
+    keys = [team_column, 'period', 'period_seconds']
+    all_on = changes_on.merge(changes_off, on=keys, how='left')
+    off_only = changes_off.merge(changes_on, on=keys, how='left', indicator=True).query("_merge != 'both'").drop(columns=['_merge'])
+    full_changes = pd.concat([all_on, off_only]).sort_values(by=['period', 'period_seconds']).reset_index(drop=True)
+
+    seconds = full_changes['period_seconds'].to_numpy()
+    full_changes.insert(2, 'time', [f"{second // 60}:{second % 60:02d}" for second in seconds])
+    full_changes = full_changes[[column for column in full_changes.columns if column != 'period_seconds'] + ['period_seconds']]
+    full_changes['game_seconds'] = np.where(full_changes.period < 5, (full_changes.period - 1) * 1200 + seconds, 3900)
+
+    if 'is_home' in source.columns and team_column != 'is_home':
+        sides = pd.DataFrame({team_column: teams, 'is_home': source['is_home'].to_numpy()[rows]}).drop_duplicates(team_column)
+        full_changes = full_changes.merge(sides, on=team_column, how='left')
+
+    return full_changes
+
+def _unit_stints(codes, start, end, size):
+    # Sorted sweep over the change points of one team's shifts. Between two change points the players on the ice
+    # don't change, so every combination of `size` of them gets the segment's seconds. A new stint together starts
+    # when the combination wasn't on the ice in the previous segment or a period starts.
+    # Returns {combination of player codes: [seconds, stints]}
+    keep = start < end
+    codes, start, end = codes[keep], start[keep], end[keep]
+    times = np.concatenate([start, end])
+    order = np.argsort(times, kind='stable')
+    times = times[order]
+    players = np.concatenate([codes, codes])[order]
+    deltas = np.concatenate([np.ones(len(start), dtype=np.int64), -np.ones(len(end), dtype=np.int64)])[order]
+    boundaries, first = np.unique(times, return_index=True)
+
+    counts = np.zeros(int(codes.max()) + 1 if len(codes) else 0, dtype=np.int64)
+    units = {}
+    previous = set()
+    for i in range(len(boundaries) - 1):
+        np.add.at(counts, players[first[i]:first[i + 1]], deltas[first[i]:first[i + 1]])
+        on_ice = np.flatnonzero(counts > 0).tolist()
+        current = set(itertools.combinations(on_ice, size)) if len(on_ice) >= size else set()
+        continuing = previous if boundaries[i] % 1200 else set()
+        for combination in current:
+            unit = units.setdefault(combination, [0, 0])
+            unit[0] += int(boundaries[i + 1] - boundaries[i])
+            unit[1] += combination not in continuing
+        previous = current
+    return units
+
+def line_combinations(shifts, side: str = 'home', min_toi: int = 60) -> pd.DataFrame:
+    '''
+    Forward trios and defense pairs of a team, with their shared TOI and number of shifts together.
+
+    Computed with a sorted sweep over the shift change points of each game (see _unit_stints), so the cost
+    grows with the number of shifts, not seconds. Shared TOI counts every second all the players of the unit
+    are on the ice, whoever else is; a shift together ends when one of them goes off or the period ends.
+
+    Parameters
+    ----------
+    shifts : Union[pd.DataFrame, GameShifts, list]
+        Shifts of one game (fetch_shifts dataframe or GameShifts), or an iterable of them for several games,
+        e.g. a season.
+    side : str, optional
+        'home', 'away', or a team abbreviation (matched on the abbrev column), which is the one to use
+        across several games. The default is 'home'.
+    min_toi : int, optional
+        Units with less shared TOI (in seconds) over all the games are dropped. The default is 60.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per unit with unit ('F' trio or 'D' pair, see LINE_UNITS), player1_id..player3_id (sorted,
+        player3 is missing for pairs), player1_name..player3_name, TOI (seconds), shifts and GP (games
+        together), sorted by unit and TOI.
+    '''
+    games = [shifts] if isinstance(shifts, (pd.DataFrame, GameShifts)) else shifts
+
+    totals, names = {}, {}
+    for game in games:
+        for unit, (positions, size) in LINE_UNITS.items():
+            codes, players, start, end = _shift_arrays(game, positions=positions)
+            team = _team_mask(players, side)
+            player_ids = players['playerId'].to_numpy().astype(np.int64)
+            if 'fullName' in players.columns:
+                names.update(zip(player_ids[team], players['fullName'].to_numpy()[team]))
+
+            keep = team[codes]
+            for combination, (seconds, stints) in _unit_stints(codes[keep], start[keep], end[keep], size).items():
+                total = totals.setdefault((unit,) + tuple(sorted(player_ids[list(combination)])), [0, 0, 0])
+                total[0] += seconds
+                total[1] += stints
+                total[2] += 1
+
+    rows = [key + (None,) * (4 - len(key)) + tuple(value) for key, value in totals.items() if value[0] >= min_toi]
+    df = pd.DataFrame(rows, columns=['unit', 'player1_id', 'player2_id', 'player3_id', 'TOI', 'shifts', 'GP'])
+    for position in range(1, 4):
+        df[f'player{position}_id'] = df[f'player{position}_id'].astype('Int64')
+    for position in range(1, 4):
+        df[f'player{position}_name'] = df[f'player{position}_id'].map(names)
+    df = df[['unit', 'player1_id', 'player2_id', 'player3_id', 'player1_name', 'player2_name', 'player3_name', 'TOI', 'shifts', 'GP']]
+
+    return df.sort_values(['unit', 'TOI'], ascending=False).reset_index(drop=True)
+
+def game_anomalies(pbp: pd.DataFrame, shifts_df: pd.DataFrame, on_ice: Union[pd.DataFrame, None] = None) -> pd.DataFrame:
+    '''
+    Data-quality checks of a game's shifts and on-ice players, as one row per anomaly.
+
+    Checks (see ANOMALY_CHECKS):
+      too_many_players: more than MAX_SKATERS players (goalies included) on the ice for a team at an event.
+      too_few_skaters: fewer than 3 skaters on the ice for a team at a non-faceoff event.
+      missing_goalie: no goalie and fewer than MAX_SKATERS skaters (so not an extra attacker) at a non-faceoff event.
+      overlapping_shift: a shift starting before the previous shift of the same player ended.
+      negative_duration: a shift ending before it starts.
+
+    Parameters
+    ----------
+    pbp : pd.DataFrame
+        Play-by-play dataframe (scrape_game).
+    shifts_df : Union[pd.DataFrame, GameShifts]
+        Shifts dataframe of the game, with positionCode, or GameShifts.
+    on_ice : Union[pd.DataFrame, None], optional
+        Long on-ice table (on_ice_long). Resolved from pbp and shifts_df when None.
+
+    Returns
+    -------
+    pd.DataFrame with columns game_id, check, side, playerId, event_idx, elapsedTime, value (the count or
+    the seconds involved). Results of several games can be concatenated and aggregated by check.
+    '''
+    if on_ice is None:
+        on_ice = on_ice_long(pbp, shifts_df)
+    codes, players, start, end = _shift_arrays(shifts_df, positive_only=False)
+    player_sides = np.where(players['is_home'].to_numpy() == 1, 'home', 'away')
+    if 'positionCode' not in on_ice.columns:
+        positions = pd.DataFrame({'side': player_sides, 'playerId': players['playerId'].to_numpy(), 'positionCode': players['positionCode'].to_numpy()})
+        on_ice = on_ice.merge(positions, on=['side', 'playerId'], how='left')
+
+    anomalies = []
+
+    # On-ice counts per (event, side) over the play events on_ice_long resolves, zero when nobody of a side is on the ice
+    times = pd.to_numeric(pbp['elapsedTime'], errors='coerce')
+    plays = pbp.index[(pbp['event_team'].notna() & times.notna() & ((pbp['event'] == 'faceoff') | (times > 0))).to_numpy()]
+    counts = (on_ice.assign(side=on_ice['side'].astype(str), skater=~on_ice['positionCode'].isin(['G', np.nan]),
+                            goalie=on_ice['positionCode'] == 'G')
+                    .groupby(['event_idx', 'side'])
+                    .agg(players=('playerId', 'size'), skaters=('skater', 'sum'), goalies=('goalie', 'sum'))
+                    .reindex(pd.MultiIndex.from_product([plays, ['home', 'away']], names=['event_idx', 'side']), fill_value=0)
+                    .reset_index())
+    events = pbp.loc[counts['event_idx'], ['event', 'elapsedTime']].to_numpy()
+    counts['game_id'], counts['event'], counts['elapsedTime'] = pbp.loc[counts['event_idx'], 'game_id'].to_numpy(), events[:, 0], events[:, 1]
+    not_faceoff = counts['event'] != 'faceoff'
+
+    for check, mask, value in [('too_many_players', counts['players'] > MAX_SKATERS, 'players'),
+                               ('too_few_skaters', not_faceoff & (counts['skaters'] < 3), 'skaters'),
+                               ('missing_goalie', not_faceoff & (counts['goalies'] == 0) & (counts['skaters'] < MAX_SKATERS), 'skaters')]:
+        flagged = counts[mask]
+        anomalies.append(pd.DataFrame({'game_id': flagged['game_id'], 'check': check, 'side': flagged['side'].astype(object),
+                                       'playerId': np.nan, 'event_idx': flagged['event_idx'],
+                                       'elapsedTime': flagged['elapsedTime'], 'value': flagged[value]}))
+
+    # Shifts sorted by team, player, start and end: previous end of the same player, overlapping when the next shift starts before it
+    order = np.lexsort((end, start, players['playerId'].to_numpy()[codes], players['is_home'].to_numpy()[codes]))
+    codes, start, end = codes[order], start[order].astype(float), end[order].astype(float)
+    same_player = np.append(False, codes[1:] == codes[:-1])
+    previous_end = np.append(np.nan, pd.Series(end).groupby(codes, sort=False).cummax().to_numpy()[:-1])[:len(end)]
+    sides, player_ids = player_sides[codes], players['playerId'].to_numpy()[codes]
+
+    for check, mask, value in [('overlapping_shift', same_player & (start < previous_end), previous_end - start),
+                               ('negative_duration', end < start, start - end)]:
+        anomalies.append(pd.DataFrame({'game_id': pbp['game_id'].iloc[0], 'check': check, 'side': sides[mask],
+                                       'playerId': player_ids[mask], 'event_idx': np.nan,
+                                       'elapsedTime': start[mask], 'value': value[mask]}))
+
+    anomalies = pd.concat(anomalies, ignore_index=True)
+    anomalies['check'] = pd.Categorical(anomalies['check'], categories=ANOMALY_CHECKS)
+    return anomalies
 
 #Fetch scripts
 
-def fetch_play_by_play_json(game_id: int) -> Dict:
+_session = requests.Session()
+_conditional_cache = OrderedDict()
+_conditional_cache_lock = threading.Lock()
+
+def fetch_json(url: str, conditional: bool = False) -> Dict:
+    """
+    GETs a JSON endpoint. With conditional, reuses the previously parsed object when the payload did not change.
+
+    Conditional requests are meant for callers polling the same URLs (LiveGame, ScheduleIndex.refresh):
+    the ETag / Last-Modified validators of the last response for a URL are sent back as
+    If-None-Match / If-Modified-Since. On a 304, or when the body hash matches the previous body
+    (for servers that don't send validators), the cached object is returned without parsing.
+    That object is shared between the conditional calls and should be treated as read-only. The last
+    CONDITIONAL_CACHE_SIZE URLs are kept. Plain calls don't touch the cache and return a fresh object.
+
+    Args:
+      url: URL of the endpoint.
+      conditional: Whether to send a conditional request and reuse the cached payload. Defaulted to False.
+
+    Returns:
+      The parsed JSON payload.
+
+    Raises:
+      requests.exceptions.RequestException: If there's an issue with the request.
+    """
+    if not conditional:
+        response = _session.get(url)
+        response.raise_for_status()
+        return _json_loads(response.content)
+
+    with _conditional_cache_lock:
+        cached = _conditional_cache.get(url)
+
+    headers = {}
+    if cached is not None:
+        if cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    response = _session.get(url, headers=headers)
+
+    if response.status_code == 304 and cached is not None:
+        data = cached['data']
+    else:
+        response.raise_for_status()
+        body_hash = hashlib.blake2b(response.content, digest_size=16).digest()
+        data = cached['data'] if cached is not None and cached['hash'] == body_hash else _json_loads(response.content)
+        cached = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified'),
+                  'hash': body_hash, 'data': data}
+
+    with _conditional_cache_lock:
+        _conditional_cache[url] = cached
+        _conditional_cache.move_to_end(url)
+        while len(_conditional_cache) > CONDITIONAL_CACHE_SIZE:
+            _conditional_cache.popitem(last=False)
+
+    return data
+
+def fetch_play_by_play_json(game_id: int, conditional: bool = False) -> Dict:
     """
     Connects to the NHL API to get the data for a given game.
 
     Args:
       game_id: Identifier ID for a given game.
+      conditional: Conditional request for polling, see fetch_json. Defaulted to False.
 
     Returns:
       A JSON file with the information of the game.
@@ -325,17 +978,16 @@ def fetch_play_by_play_json(game_id: int) -> Dict:
     Raises:
       requests.exceptions.RequestException: If there's an issue with the request.
     """
-    response = requests.get(PLAY_BY_PLAY_ENDPOINT.format(game_id=game_id))
-    response.raise_for_status()  # Raise an error for bad responses.
-    return response.json()
+    return fetch_json(PLAY_BY_PLAY_ENDPOINT.format(game_id=game_id), conditional)
 
-def fetch_team_schedule_json(team_abbr: str = DEFAULT_TEAM, season: int = DEFAULT_SEASON) -> Dict:
+def fetch_team_schedule_json(team_abbr: str = DEFAULT_TEAM, season: int = DEFAULT_SEASON, conditional: bool = False) -> Dict:
     """
     Connects to the NHL API to get the data for a given team's schedule.
 
     Args:
       team_abbr: Team abbreviation.
       season: Desired season in the format of {year_start}{year_end}.
+      conditional: Conditional request for polling, see fetch_json. Defaulted to False.
 
     Returns:
       A JSON file with the schedule of a given team.
@@ -343,9 +995,7 @@ def fetch_team_schedule_json(team_abbr: str = DEFAULT_TEAM, season: int = DEFAUL
     Raises:
       requests.exceptions.RequestException: If there's an issue with the request.
     """
-    response = requests.get(SCHEDULE_ENDPOINT.format(team_abbr=team_abbr, season=season))
-    response.raise_for_status()
-    return response.json()
+    return fetch_json(SCHEDULE_ENDPOINT.format(team_abbr=team_abbr, season=season), conditional)
 
 def fetch_game_rosters(game_id: int, side: Union[str, None] = None, pbp_json: Union[Dict, None] = None) -> pd.DataFrame:
     """
@@ -363,9 +1013,10 @@ def fetch_game_rosters(game_id: int, side: Union[str, None] = None, pbp_json: Un
     pbp_json = fetch_play_by_play_json(game_id) if pbp_json is None else pbp_json
 
 
-    players = pd.json_normalize(pbp_json.get("rosterSpots", [])).filter(['teamId', 'playerId', 'sweaterNumber', 'positionCode', 'headshot',
-       'firstName.default', 'lastName.default']).rename(columns={'lastName.default':'lastName',
-                  'firstName.default':'firstName'}).rename(columns={"id":"teamId","name":"team"})
+    spots = pbp_json.get("rosterSpots", [])
+    players = pd.DataFrame({column: [spot.get(column) for spot in spots] for column in ['teamId', 'playerId', 'sweaterNumber', 'positionCode', 'headshot']})
+    players['firstName'] = [(spot.get('firstName') or {}).get('default') for spot in spots]
+    players['lastName'] = [(spot.get('lastName') or {}).get('default') for spot in spots]
     home_team, away_team = pd.json_normalize(pbp_json.get("homeTeam", [])), pd.json_normalize(pbp_json.get("awayTeam", []))
     teams = pd.concat([home_team.assign(is_home=1), away_team.assign(is_home=0)]).rename(columns={"id":"teamId", "name":"team"})
     players = players.merge(teams[["teamId", "abbrev", "is_home"]], on="teamId", how="left")
@@ -375,6 +1026,46 @@ def fetch_game_rosters(game_id: int, side: Union[str, None] = None, pbp_json: Un
 
     return filter_players(players, side)
 
+_plays_cache = OrderedDict()
+_plays_cache_lock = threading.Lock()
+
+def plays_table(pbp_json: Dict) -> pd.DataFrame:
+    """
+    Flattens the plays of a play-by-play payload into a dataframe with the PLAY_FIELDS columns.
+
+    Only those fields are extracted, one column at a time, instead of normalizing every nested field.
+    The table of the last PLAYS_CACHE_SIZE payloads is kept, so scrape_game and the shift fetchers
+    flatten a payload once; every call returns its own copy.
+
+    Args:
+      pbp_json: JSON file of the Play-by-Play data of a game.
+
+    Returns:
+      A DataFrame with one row per play.
+    """
+    plays = pbp_json.get("plays", [])
+    with _plays_cache_lock:
+        cached = _plays_cache.get(id(plays))
+    # The payload is kept in the entry, so its id can't be reused by another list while cached
+    if cached is not None and cached[0] is plays:
+        return cached[1].copy()
+
+    parents = {'periodDescriptor': [play.get('periodDescriptor') or {} for play in plays],
+               'details': [play.get('details') or {} for play in plays]}
+    columns = {}
+    for field in PLAY_FIELDS:
+        parent, _, key = field.rpartition('.')
+        columns[field] = [record.get(key) for record in parents[parent]] if parent else [play.get(key) for play in plays]
+    df = pd.DataFrame(columns)
+
+    with _plays_cache_lock:
+        _plays_cache[id(plays)] = (plays, df)
+        _plays_cache.move_to_end(id(plays))
+        while len(_plays_cache) > PLAYS_CACHE_SIZE:
+            _plays_cache.popitem(last=False)
+
+    return df.copy()
+
 def fetch_html_shifts(game_id: int , season: Union[int, None] = None, pbp_json: Union[str, None] = None) -> pd.DataFrame: ### DEPPRECATED ###
     '''Retrives a Dataframe of the shifts actions for a given game.
     ##### Stolen from Patrick Bacon #####
@@ -860,30 +1551,20 @@ def fetch_html_shifts(game_id: int , season: Union[int, None] = None, pbp_json:
 
     away_shifts = alldf
     
-    all_shifts = pd.concat([home_shifts, away_shifts])
-    
-    all_shifts = all_shifts.assign(start_time = all_shifts.shift_start.str.split('/').str[0])
-    
-    all_shifts = all_shifts.assign(end_time = all_shifts.shift_end.str.split('/').str[0])
-    
-    #all_shifts = all_shifts[~all_shifts.end_time.str.contains('\xa0')]
+    all_shifts = pd.concat([home_shifts, away_shifts], ignore_index=True)
     
     all_shifts.period = (np.where(all_shifts.period=='OT', 4, all_shifts.period)).astype(int)
-    
-    all_shifts = all_shifts.assign(end_time = np.where(~all_shifts.shift_end.str.contains('\xa0'), all_shifts.end_time,
-              (np.where(
-              (((pd.to_datetime(((60 * (all_shifts.start_time.str.split(':').str[0].astype(int))) + 
-              (all_shifts.start_time.str.split(':').str[1].astype(int)) + 
-                (60 * (all_shifts.duration.str.split(':').str[0].astype(int))).astype(int) +
-              (all_shifts.duration.str.split(':').str[1].astype(int))).astype(int), unit = 's'))).dt.time).astype(str).str[3:].str[0]=='0',
-              (((pd.to_datetime(((60 * (all_shifts.start_time.str.split(':').str[0].astype(int))) + 
-              (all_shifts.start_time.str.split(':').str[1].astype(int)) + 
-                (60 * (all_shifts.duration.str.split(':').str[0].astype(int))).astype(int) +
-              (all_shifts.duration.str.split(':').str[1].astype(int))).astype(int), unit = 's'))).dt.time).astype(str).str[4:],
-              (((pd.to_datetime(((60 * (all_shifts.start_time.str.split(':').str[0].astype(int))) + 
-              (all_shifts.start_time.str.split(':').str[1].astype(int)) + 
-                (60 * (all_shifts.duration.str.split(':').str[0].astype(int))).astype(int) +
-              (all_shifts.duration.str.split(':').str[1].astype(int))).astype(int), unit = 's'))).dt.time).astype(str).str[4:]))))
+
+    # Clock times as int seconds of the period, each field parsed once
+    start_s = clock_to_sec(all_shifts.shift_start.str.split('/').str[0])
+
+    # Shifts without an end time end at start + duration. Like the former time-string repair,
+    # only the last digit of the minutes is kept.
+    missing_end = all_shifts.shift_end.str.contains('\xa0').to_numpy()
+    end_s = np.zeros(len(all_shifts), dtype=np.int64)
+    end_s[~missing_end] = clock_to_sec(all_shifts.shift_end[~missing_end].str.split('/').str[0])
+    repaired = start_s[missing_end] + clock_to_sec(all_shifts.duration[missing_end])
+    end_s[missing_end] = repaired // 60 % 10 * 60 + repaired % 60
     
     all_shifts['name'] = np.where(all_shifts['name'].str.contains('ALEXANDRE '), 
                                 all_shifts.name.str.replace('ALEXANDRE ', 'ALEX '),
@@ -1042,56 +1723,24 @@ def fetch_html_shifts(game_id: int , season: Union[int, None] = None, pbp_json:
     )))))))))))))))))))))))))))))))))
     
     
-    all_shifts = all_shifts.assign(end_time = np.where(pd.to_datetime(all_shifts.start_time).dt.time > pd.to_datetime(all_shifts.end_time).dt.time, '20:00', all_shifts.end_time),
-                                  goalie = np.where(all_shifts.name.isin(goalie_names), 1, 0))
-    
-    all_shifts = all_shifts.merge(all_shifts.groupby(['team', 'period'])['goalie'].sum().reset_index().rename(columns = {'goalie':'period_gs'}))
-    
-    # Implement fix for goalies: Goalies who showed up late in the period and were the only goalie to play have their start time re-set to 0:00. 
-    
-    all_shifts = all_shifts.assign(start_time = np.where((all_shifts.goalie==1) & (all_shifts.start_time!='0:00') & (all_shifts.period_gs==1), '0:00', all_shifts.start_time))
-    
-    all_shifts = all_shifts.assign(end_time = np.where(
-    (pd.to_datetime(all_shifts.start_time).dt.time < datetime(2021, 6, 10, 18, 0, 0).time()) & 
-    (all_shifts.period!=3) & (all_shifts.period!=4) & 
-    (all_shifts.goalie==1) &
-    (all_shifts.period_gs==1),
-    '20:00', all_shifts.end_time))
-    
-    all_shifts = all_shifts.assign(end_time = np.where(
-    (pd.to_datetime(all_shifts.start_time).dt.time < datetime(2021, 6, 10, 13, 0, 0).time()) & 
-    (all_shifts.period!=4) &
-    (all_shifts.goalie==1) &
-    (all_shifts.period_gs==1),
-    '20:00', all_shifts.end_time))
-    
-    myshifts = all_shifts
-    
-    myshifts.start_time = myshifts.start_time.str.strip()
-    myshifts.end_time = myshifts.end_time.str.strip()
-
-    changes_on = myshifts.groupby(['team', 'period', 'start_time']).agg(
-        on = ('name', ', '.join),
-        on_numbers = ('number', ', '.join),
-        number_on = ('name', 'count')
-    ).reset_index().rename(columns = {'start_time':'time'}).sort_values(by = ['team', 'period', 'time'])
-    
-    changes_off = myshifts.groupby(['team', 'period', 'end_time']).agg(
-        off = ('name', ', '.join),
-        off_numbers = ('number', ', '.join),
-        number_off = ('name', 'count')
-    ).reset_index().rename(columns = {'end_time':'time'}).sort_values(by = ['team', 'period', 'time'])
-    
-    all_on = changes_on.merge(changes_off, on = ['team', 'period', 'time'], how = 'left')
-    off_only = changes_off.merge(changes_on, on = ['team', 'period', 'time'], how = 'left', indicator = True)[
-    changes_off.merge(changes_on, on = ['team', 'period', 'time'], how = 'left', indicator = True)['_merge']!='both']
-    full_changes = pd.concat([all_on, off_only]).sort_values(by = ['period', 'time']).drop(columns = ['_merge'])
-    
-    full_changes['period_seconds'] = full_changes.time.str.split(':').str[0].astype(int) * 60 + full_changes.time.str.split(':').str[1].astype(int)
+    # Shifts ending before they start were cut by the end of the period
+    end_s = np.where(start_s > end_s, 1200, end_s)
 
-    full_changes['game_seconds'] = (np.where(full_changes.period<5, 
-                                   (((full_changes.period - 1) * 1200) + full_changes.period_seconds),
-                          3900))
+    # Implement fix for goalies: Goalies who showed up late in the period and were the only goalie to play have their start time re-set to 0:00. 
+    goalie = all_shifts.name.isin(goalie_names).to_numpy()
+    only_goalie = goalie & (pd.Series(goalie).groupby([all_shifts.team, all_shifts.period]).transform('sum') == 1).to_numpy()
+    period = all_shifts.period.to_numpy()
+    start_s = np.where(only_goalie, 0, start_s)
+    end_s = np.where(only_goalie & (start_s < 18 * 60) & (period != 3) & (period != 4), 1200, end_s)
+    end_s = np.where(only_goalie & (start_s < 13 * 60) & (period != 4), 1200, end_s)
+
+    full_changes = shift_changes(all_shifts.assign(startTime_s = start_s + (period - 1) * 1200,
+                                                   endTime_s = end_s + (period - 1) * 1200,
+                                                   fullName = all_shifts.name,
+                                                   sweaterNumber = all_shifts.number), team_column='team')
+
+    # Former ordering, on the clock strings
+    full_changes = full_changes.sort_values(by = ['period', 'time'])
     
     full_changes = full_changes.assign(team = np.where(full_changes.team=='CANADIENS MONTREAL', 'MONTREAL CANADIENS', full_changes.team))
     full_changes = full_changes.assign(team = np.where(full_changes.team=='MONTRÃAL CANADIENS', 'MONTREAL CANADIENS', full_changes.team))
@@ -1102,13 +1751,15 @@ def fetch_html_shifts(game_id: int , season: Union[int, None] = None, pbp_json:
     full_changes.loc[full_changes['team'].str.contains(pbp_json['homeTeam']['name'], case=False), 'is_home'] = 1
     return full_changes
 
-def fetch_api_shifts(game_id, pbp_json=None):
+def fetch_api_shifts(game_id, pbp_json=None, shifts_json=None):
     '''
     Fetches shifts data from the NHL API and returns a DataFrame with the data.
     ----
     :param game_id: The game ID of the game to fetch shifts for.
     :param pbp_json: The play-by-play JSON for the game. If not provided, it will be fetched from the API.
+    :param shifts_json: The shift chart JSON for the game. If not provided, it will be fetched from the API.
     :return: A DataFrame containing the shifts data for the game.
+    :raises IndexError: If this game has no shift data.
     '''
 
 
@@ -1119,7 +1770,10 @@ def fetch_api_shifts(game_id, pbp_json=None):
     # away_team_abbrev = pbp_json["awayTeam"]["abbrev"]
 
     # Fetch shifts data from the API
-    shifts_data = requests.get(SHIFT_API_ENDPOINT.format(game_id=game_id)).json()['data']
+    shifts_json = fetch_json(SHIFT_API_ENDPOINT.format(game_id=game_id)) if shifts_json is None else shifts_json
+    shifts_data = shifts_json.get('data', [])
+    if len(shifts_data)==0:
+        raise IndexError('This game has no shift data.')
 
     # Create a DataFrame and perform data transformations
     shift_df = pd.json_normalize(shifts_data)
@@ -1141,7 +1795,7 @@ def fetch_api_shifts(game_id, pbp_json=None):
 
     shift_df["type"] = "OTF"
 
-    faceoffs = (pd.json_normalize(pbp_json["plays"])
+    faceoffs = (plays_table(pbp_json)
                 .query('typeDescKey=="faceoff"')
                 .filter(['timeInPeriod','homeTeamDefendingSide', 'details.xCoord','details.zoneCode', 'period'])
                 .assign(current_time = lambda x: x['timeInPeriod'].apply(str_to_sec) +20*60* (x['period']-1))
@@ -1192,26 +1846,42 @@ def fetch_api_shifts(game_id, pbp_json=None):
 
     return shift_df
 
-def fetch_html_shifts2(game_id=2023020069, season=None, pbp_json=None):
-    ''' 
-    Fetches shifts data from the NHL API and returns a DataFrame with the data.
-    ----
-    :param game_id: The game ID of the game to fetch shifts for.
-    :param season: The season of the game. If not provided, it will be fetched from the API.
-    :param pbp_json: The play-by-play JSON for the game. If not provided, it will be fetched from the API.
-    :return: A DataFrame containing the shifts data for the game.
-    '''
+def fetch_shift_report(game_id: int, is_home: bool = True, season: Union[int, None] = None) -> bytes:
+    """
+    Downloads the raw HTML shift report (TH for the home team, TV for the away team) of a game.
 
-    pbp_json = fetch_play_by_play_json(game_id) if pbp_json is None else pbp_json
-    rosters = fetch_game_rosters(game_id)
+    Args:
+      game_id: Identifier ID for a given game.
+      is_home: Whether to get the home (TH) or away (TV) report.
+      season: Season of the game. Derived from the game ID when None.
 
+    Returns:
+      The raw bytes of the report.
+
+    Raises:
+      requests.exceptions.RequestException: If there's an issue with the request, e.g. the report doesn't exist (404).
+    """
     season = f"{str(game_id)[:4]}{int(str(game_id)[:4]) + 1}" if season is None else season
+    endpoint = SHIFT_REPORT_HOME_ENDPOINT if is_home else SHIFT_REPORT_AWAY_ENDPOINT
+    response = _session.get(endpoint.format(season=season, game_id=str(game_id)[4:]))
+    response.raise_for_status()
+    return response.content
 
+def parse_shift_report(content: bytes, is_home: bool = True) -> pd.DataFrame:
+    """
+    Parses a raw TH/TV HTML shift report into one row per shift.
 
-    ### HOME SHIFTS ###
-    url = SHIFT_REPORT_HOME_ENDPOINT.format(season=season, game_id=str(game_id)[4:])
-    page = (requests.get(url))
-    soup = BeautifulSoup(page.content.decode('ISO-8859-1'), 'lxml', multi_valued_attributes = None, from_encoding='utf-8')
+    Args:
+      content: Raw bytes of the report (see fetch_shift_report).
+      is_home: Whether the report is the home (TH) or away (TV) one.
+
+    Returns:
+      A DataFrame with shift_number, period, shift_start, shift_end, duration, name, sweaterNumber, team and is_home.
+
+    Raises:
+      IndexError: If this game has no shift data.
+    """
+    soup = BeautifulSoup(content.decode('ISO-8859-1'), 'lxml', multi_valued_attributes = None, from_encoding='utf-8')
     found = soup.find_all('td', {'class':['playerHeading + border', 'lborder + bborder']})
     if len(found)==0:
         raise IndexError('This game has no shift data.')
@@ -1234,7 +1904,7 @@ def fetch_html_shifts2(game_id=2023020069, season=None, pbp_json=None):
         else:
             players[full_name]['shifts'].extend([line])
 
-    alldf = pd.DataFrame()
+    dfs = []
 
     for key in players.keys(): 
         length = int(len(np.array((players[key]['shifts'])))/5)
@@ -1243,50 +1913,39 @@ def fetch_html_shifts2(game_id=2023020069, season=None, pbp_json=None):
         df = df.assign(name = players[key]['name'],
                       sweaterNumber = int(players[key]['number']),
                       team = thisteam,
-                      is_home = 1)
-        alldf = pd.concat([alldf, df], ignore_index=True)
+                      is_home = int(is_home))
+        dfs.append(df)
         
-    home_shifts = alldf
+    return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
 
-    ### AWAY SHIFTS ###
-    url = SHIFT_REPORT_AWAY_ENDPOINT.format(season=season, game_id=str(game_id)[4:])
-    page = (requests.get(url))
-    soup = BeautifulSoup(page.content.decode('ISO-8859-1'), 'lxml', multi_valued_attributes = None, from_encoding='utf-8')
-    found = soup.find_all('td', {'class':['playerHeading + border', 'lborder + bborder']})
-    if len(found)==0:
-        raise IndexError('This game has no shift data.')
-    thisteam = soup.find('td', {'align':'center', 'class':'teamHeading + border'}).get_text()
-    
+def fetch_html_shifts2(game_id=2023020069, season=None, pbp_json=None, home_report=None, away_report=None):
+    ''' 
+    Fetches shifts data from the NHL API and returns a DataFrame with the data.
+    ----
+    :param game_id: The game ID of the game to fetch shifts for.
+    :param season: The season of the game. If not provided, it will be fetched from the API.
+    :param pbp_json: The play-by-play JSON for the game. If not provided, it will be fetched from the API.
+    :param home_report: Raw TH report (bytes). If not provided, it will be downloaded.
+    :param away_report: Raw TV report (bytes). If not provided, it will be downloaded.
+    :return: A DataFrame containing the shifts data for the game.
+    '''
 
-    players = dict()
-    for i in range(len(found)):
-        line = found[i].get_text()
-        if ', ' in line:
-            name = line.split(',')
-            number = name[0].split(' ')[0].strip()
-            last_name =  name[0].split(' ')[1].strip()
-            first_name = name[1].strip()
-            full_name = first_name + " " + last_name
-            players[full_name] = dict()
-            players[full_name]['number'] = number
-            players[full_name]['name'] = full_name
-            players[full_name]['shifts'] = []
-        else:
-            players[full_name]['shifts'].extend([line])
+    pbp_json = fetch_play_by_play_json(game_id) if pbp_json is None else pbp_json
+    rosters = fetch_game_rosters(game_id, pbp_json=pbp_json)
 
-    alldf = pd.DataFrame()
+    # Both reports are downloaded concurrently
+    if home_report is None or away_report is None:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            home_future = executor.submit(fetch_shift_report, game_id, True, season) if home_report is None else None
+            away_future = executor.submit(fetch_shift_report, game_id, False, season) if away_report is None else None
+            home_report = home_future.result() if home_future is not None else home_report
+            away_report = away_future.result() if away_future is not None else away_report
 
-    for key in players.keys(): 
-        length = int(len(np.array((players[key]['shifts'])))/5)
-        df = pd.DataFrame(np.array((players[key]['shifts'])).reshape(length, 5)).rename(
-        columns = {0:'shift_number', 1:'period', 2:'shift_start', 3:'shift_end', 4:'duration'})
-        df = df.assign(name = players[key]['name'],
-                      sweaterNumber = int(players[key]['number']),
-                      team = thisteam,
-                      is_home = 0)
-        alldf = pd.concat([alldf, df], ignore_index=True)
-        
-    away_shifts = alldf
+    ### HOME SHIFTS ###
+    home_shifts = parse_shift_report(home_report, True)
+
+    ### AWAY SHIFTS ###
+    away_shifts = parse_shift_report(away_report, False)
 
     ### MERGE SHIFTS ###
     all_shifts = (pd.concat([home_shifts, away_shifts], ignore_index=True)
@@ -1308,7 +1967,7 @@ def fetch_html_shifts2(game_id=2023020069, season=None, pbp_json=None):
     
     all_shifts["type"] = "OTF"
 
-    faceoffs = (pd.json_normalize(pbp_json["plays"])
+    faceoffs = (plays_table(pbp_json)
                 .query('typeDescKey=="faceoff"')
                 .filter(['timeInPeriod','homeTeamDefendingSide', 'details.xCoord','details.zoneCode', 'period'])
                 .assign(current_time = lambda x: x['timeInPeriod'].apply(str_to_sec) +20*60* (x['period']-1))
@@ -1360,11 +2019,102 @@ def fetch_html_shifts2(game_id=2023020069, season=None, pbp_json=None):
     return all_shifts
 
 
+def build_shifts(game_id: int, source: str, raw: List, pbp_json: Dict, season: Union[int, None] = None) -> pd.DataFrame:
+    """
+    Builds the shifts dataframe of fetch_shifts from already downloaded payloads.
+
+    Args:
+      game_id: Identifier ID for a given game.
+      source: "html" or "api".
+      raw: [TH report, TV report] bytes for "html", [shift chart JSON] for "api".
+      pbp_json: JSON file of the Play-by-Play data of the game.
+      season: Season of the game. Derived from the game ID when None.
+
+    Returns:
+      A DataFrame with one row per shift, the source is stored in df.attrs['source'].
+
+    Raises:
+      IndexError: If the payloads have no shift data.
+    """
+    if source == 'html':
+        shifts = fetch_html_shifts2(game_id, season, pbp_json, home_report=raw[0], away_report=raw[1])
+    else:
+        shifts = fetch_api_shifts(game_id, pbp_json=pbp_json, shifts_json=raw[0])
+        rosters = fetch_game_rosters(game_id, pbp_json=pbp_json)
+        shifts = shifts.merge(rosters[['playerId', 'sweaterNumber', 'positionCode', 'abbrev']], on='playerId', how='left')
+        shifts['game_id'] = game_id
+    shifts.attrs['source'] = source
+    return shifts
+
+def fetch_shifts(game_id: int, source: str = "auto", pbp_json: Union[Dict, None] = None, season: Union[int, None] = None) -> pd.DataFrame:
+    """
+    Fetches the shifts of a game from the HTML shift reports or the shift chart API, whichever is available.
+
+    The TH/TV reports, the shift chart and (if needed) the play-by-play are downloaded concurrently,
+    so the latency is the one of the slowest single request. API shifts get the roster columns of
+    the HTML ones (sweaterNumber, positionCode, abbrev, game_id) so both sources can be used interchangeably.
+    The source that was used is stored in df.attrs['source'].
+
+    Args:
+      game_id: Identifier ID for a given game.
+      source: "auto" tries SHIFT_SOURCES in order and falls back when a source has no shift data,
+        "first" uses whichever source completes validly first, "html" or "api" uses only that source.
+      pbp_json: JSON file of the Play-by-Play data of the game. Defaulted to None.
+      season: Season of the game. Derived from the game ID when None.
+
+    Returns:
+      A DataFrame with one row per shift.
+
+    Raises:
+      IndexError: If this game has no shift data in any of the sources.
+    """
+    sources = {'auto': SHIFT_SOURCES, 'first': SHIFT_SOURCES}.get(source, [source])
+
+    executor = ThreadPoolExecutor(max_workers=4)
+    pbp_future, raw_futures = None, {}
+    try:
+        pbp_future = executor.submit(fetch_play_by_play_json, game_id) if pbp_json is None else None
+        if 'html' in sources:
+            raw_futures['html'] = [executor.submit(fetch_shift_report, game_id, True, season),
+                                   executor.submit(fetch_shift_report, game_id, False, season)]
+        if 'api' in sources:
+            raw_futures['api'] = [executor.submit(fetch_json, SHIFT_API_ENDPOINT.format(game_id=game_id))]
+
+        pbp_json = pbp_future.result() if pbp_future is not None else pbp_json
+
+        def build(name):
+            return build_shifts(game_id, name, [future.result() for future in raw_futures[name]], pbp_json, season)
+
+        def completed_sources():
+            # Sources in the order their downloads finish
+            done = set()
+            for _ in as_completed([future for futures in raw_futures.values() for future in futures]):
+                for name, futures in raw_futures.items():
+                    if name not in done and all(future.done() for future in futures):
+                        done.add(name)
+                        yield name
+
+        for name in (completed_sources() if source == 'first' else [name for name in sources if name in raw_futures]):
+            try:
+                return build(name)
+            except (IndexError, requests.exceptions.RequestException):
+                continue
+
+        raise IndexError('This game has no shift data.')
+    finally:
+        # Downloads still queued are not needed anymore (cancel_futures needs Python 3.9)
+        for future in [pbp_future] + [future for futures in raw_futures.values() for future in futures]:
+            if future is not None:
+                future.cancel()
+        executor.shutdown(wait=False)
+
+
 #Scrape game
 
 ### STILL HAVE TO CLEAN UP THE COLUMNS OF THE DATAFRAME ###
 def scrape_game(game_id: int, pbp_json: Union[Dict, None] = None, game_rosters: Union[pd.DataFrame, None] = None, html_shifts: Union[pd.DataFrame, None] = None,
-                full_pbp: bool = True) -> Dict:
+                full_pbp: bool = True, on_ice_format: str = "wide", profile: str = "full", cache_dir: Union[str, None] = None,
+                archive: Union['PayloadArchive', None] = None) -> Dict:
     
     '''
     Scrape game from NHL API and return a dictionary of dataframes for each table.
@@ -1381,45 +2131,93 @@ def scrape_game(game_id: int, pbp_json: Union[Dict, None] = None, game_rosters:
         Shifts dataframe. The default is None.
     full_pbp : bool, optional
         Whether to return full play-by-play dataframe. The default is True.
+    on_ice_format : str, optional
+        'wide' adds the home/away_on_id/name/position_1..7 columns. 'long' skips them and returns
+        a (pbp, on_ice) tuple where on_ice is the tidy table from on_ice_long. The default is "wide".
+    profile : str, optional
+        Work to do, see SCRAPE_PROFILES. "full" is the complete frame (on-ice players only with full_pbp).
+        "events" keeps event type, coordinates, time, event player IDs and event team: no team names, logos,
+        venue, event player names, shifts or on-ice players. "on_ice" is "events" plus the on-ice
+        player IDs (no names or positions) and strength. The default is "full".
+    cache_dir : Union[str, None], optional
+        Directory of the derived-result cache. The result is read back from there when the same game was
+        scraped with the same payloads, parameters and PIPELINE_VERSION (see _derived_key). Missing
+        payloads (the play-by-play and the shift source that would be used) are still downloaded to compute
+        the key, but not processed: without an archive a cache hit saves the processing, not the network
+        time. The default is None (no cache).
+    archive : Union[PayloadArchive, None], optional
+        With cache_dir, archive the missing payloads are read from when it holds the game, so a cache hit
+        makes no request. The default is None.
     '''
+    if profile not in SCRAPE_PROFILES:
+        raise ValueError(f"profile must be one of {SCRAPE_PROFILES}.")
+    full_pbp = full_pbp if profile == "full" else profile == "on_ice"
+
+    if cache_dir is not None:
+        pbp_json, shift_payloads = _derived_inputs(game_id, pbp_json, html_shifts, need_shifts=full_pbp, archive=archive)
+
+        def compute():
+            shifts = _build_downloaded_shifts(game_id, shift_payloads, pbp_json) if shift_payloads is not None else html_shifts
+            result = scrape_game(game_id, pbp_json, game_rosters, shifts, full_pbp, on_ice_format, profile)
+            return list(result) if isinstance(result, tuple) else [result]
+
+        frames = _cached_frames(cache_dir, _derived_key('scrape_game', game_id, [pbp_json, game_rosters, html_shifts if full_pbp else None, shift_payloads],
+                                                        dict(full_pbp=full_pbp, on_ice_format=on_ice_format, profile=profile)),
+                                compute, n_parts=2 if full_pbp and on_ice_format == "long" else 1)
+        return tuple(frames) if len(frames) > 1 else frames[0]
     
     pbp_json = fetch_play_by_play_json(game_id) if pbp_json is None else pbp_json
-    game_rosters = fetch_game_rosters(game_id) if game_rosters is None else game_rosters
+    game_rosters = fetch_game_rosters(game_id, pbp_json=pbp_json) if game_rosters is None else game_rosters
     # html_shifts = fetch_html_shifts(game_id) if html_shifts is None else html_shifts
 
-    html_shifts = fetch_html_shifts2(game_id) if html_shifts is None else html_shifts
+    html_shifts = fetch_shifts(game_id, pbp_json=pbp_json) if html_shifts is None and full_pbp else html_shifts
 
     gameType = "preseason" if pbp_json.get("gameType", []) == 1 else ("regular-season" if pbp_json.get("gameType", []) == 2 else "playoffs")
 
-    df = (pd.json_normalize(pbp_json.get("plays", []))
-           .assign(game_id = game_id,
-                      gameType = gameType,
-                      season = pbp_json.get("season", []),
-                      venue = pbp_json.get("venue", []).get("default", None),
-                      startTimeUTC = pbp_json.get("startTimeUTC", []),
-                      home_abbr = pbp_json.get("homeTeam", {}).get("abbrev", None),
-                      home_name = pbp_json.get("homeTeam", []).get("name", {}).get("default", None),
-                      home_logo = pbp_json.get("homeTeam", {}).get("logo", None),
-                      away_abbr = pbp_json.get("awayTeam", {}).get("abbrev", None),
-                      away_name = pbp_json.get("awayTeam", []).get("name", {}).get("default", None),
-                      away_logo = pbp_json.get("awayTeam", {}).get("logo", None),
-                      ))
+    game_info = dict(game_id = game_id,
+                     gameType = gameType,
+                     season = pbp_json.get("season", []),
+                     startTimeUTC = pbp_json.get("startTimeUTC", []),
+                     home_abbr = pbp_json.get("homeTeam", {}).get("abbrev", None),
+                     away_abbr = pbp_json.get("awayTeam", {}).get("abbrev", None))
+    if profile == "full":
+        game_info.update(venue = pbp_json.get("venue", []).get("default", None),
+                         home_name = pbp_json.get("homeTeam", []).get("name", {}).get("default", None),
+                         home_logo = pbp_json.get("homeTeam", {}).get("logo", None),
+                         away_name = pbp_json.get("awayTeam", []).get("name", {}).get("default", None),
+                         away_logo = pbp_json.get("awayTeam", {}).get("logo", None))
+
+    df = plays_table(pbp_json).assign(**game_info)
     
     
 
     df = format_columns(df)
     df = elapsed_time(df)
+    if profile != "full":
+        df = df.drop(columns=['venue']) # Added empty by format_columns
 
     df = add_missing_columns(df)
-    df = add_event_players_info(df, game_rosters)
+    df = add_event_players_info(df, game_rosters) if profile == "full" else add_event_team(df, game_rosters)
 
     #Column names
     df.columns = [col.split('.')[-1] for col in df.columns]
 
-    if full_pbp :
-        df = process_pbp(df, html_shifts, game_rosters,True)
-        df = process_pbp(df, html_shifts, game_rosters, False)
-        df = strength(df)
+    if full_pbp and on_ice_format == "long":
+        on_ice = on_ice_long(df, html_shifts, game_rosters)
+        df = strength(df, on_ice)
+
+        df.drop(columns=[ 'winningPlayerId', 'losingPlayerId',
+       'hittingPlayerId', 'hitteePlayerId', 'shootingPlayerId',
+       'goalieInNetId', 'playerId', 'blockingPlayerId', 'scoringPlayerId',
+       'assist1PlayerId', 'assist2PlayerId', 'committedByPlayerId',
+       'drawnByPlayerId', 'servedByPlayerId', 'situationCode', 'sortOrder','eventId', 'number',], inplace=True)
+
+        return df, on_ice
+
+    elif full_pbp :
+        on_ice = on_ice_long(df, html_shifts, game_rosters)
+        df = on_ice_wide(df, on_ice, columns=None if profile == "full" else ['id'])
+        df = strength(df, on_ice)
 
         df.drop(columns=[ 'winningPlayerId', 'losingPlayerId',
        'hittingPlayerId', 'hitteePlayerId', 'shootingPlayerId',
@@ -1438,8 +2236,545 @@ def scrape_game(game_id: int, pbp_json: Union[Dict, None] = None, game_rosters:
     return df
 
 
+#Live games
+class LiveGame:
+    '''
+    Incremental scraper for an in-progress game.
+
+    Each call to poll() refetches the play-by-play with a conditional request (see fetch_json) and
+    processes only the plays newer than the previous poll (by sortOrder, or eventId when sortOrder is
+    missing): they are formatted, joined to the rosters and resolved against the latest shift data,
+    and only those rows are returned.
+
+    The shift reports lag behind the play-by-play, so with full_pbp only the plays the shifts already
+    cover (elapsedTime up to the last shift end of their period) are processed; the later plays are
+    kept for the next poll instead of being returned with incomplete on-ice players.
+
+    Parameters
+    ----------
+    game_id : int
+        Game ID to follow.
+    full_pbp : bool, optional
+        Whether to resolve on-ice players and strength (see scrape_game). The default is True.
+    '''
+
+    def __init__(self, game_id: int, full_pbp: bool = True):
+        self.game_id = game_id
+        self.full_pbp = full_pbp
+        self.game_rosters = None
+        self.last_play_key = -1
+
+    @staticmethod
+    def play_key(play: Dict) -> int:
+        key = play.get('sortOrder', play.get('eventId'))
+        return -1 if key is None else int(key)
+
+    @staticmethod
+    def covered_plays(plays: List[Dict], shifts: pd.DataFrame) -> List[Dict]:
+        '''
+        Leading plays (in play_key order) whose time is covered by the shifts of their period. Shootout
+        plays have no shifts and are always covered.
+        '''
+        period_end = shifts.groupby('period')['endTime_s'].max().to_dict()
+        covered = []
+        for play in sorted(plays, key=LiveGame.play_key):
+            period = play.get('periodDescriptor', {}).get('number', play.get('period'))
+            if play.get('periodDescriptor', {}).get('periodType') != 'SO':
+                if period not in period_end or play.get('timeInPeriod') is None:
+                    break
+                if str_to_sec(play['timeInPeriod']) + 60 * (int(period) - 1) * 20 > period_end[period]:
+                    break
+            covered.append(play)
+        return covered
+
+    def poll(self) -> pd.DataFrame:
+        '''
+        Fetch the game and process the plays added since the last poll.
+
+        Returns
+        -------
+        pd.DataFrame of the new plays, in the scrape_game format. Empty when nothing changed. The new
+        plays the shift reports don't cover yet are kept for a later poll.
+        '''
+        pbp_json = fetch_play_by_play_json(self.game_id, conditional=True)
+        new_plays = [play for play in pbp_json.get('plays', []) if self.play_key(play) > self.last_play_key]
+        if not new_plays:
+            return pd.DataFrame()
+
+        if self.game_rosters is None or len(pbp_json.get('rosterSpots', [])) != len(self.game_rosters):
+            self.game_rosters = fetch_game_rosters(self.game_id, pbp_json=pbp_json)
+
+        html_shifts = None
+        if self.full_pbp:
+            try:
+                html_shifts = fetch_shifts(self.game_id, pbp_json=pbp_json)
+            except IndexError: # This game has no shift data (yet).
+                return pd.DataFrame()
+            new_plays = self.covered_plays(new_plays, html_shifts)
+            if not new_plays:
+                return pd.DataFrame()
+
+        delta = scrape_game(self.game_id, pbp_json={**pbp_json, 'plays': new_plays}, game_rosters=self.game_rosters,
+                            html_shifts=html_shifts, full_pbp=self.full_pbp)
+
+        self.last_play_key = max(self.play_key(play) for play in new_plays)
+
+        return delta
+
+
+#Bulk scraping
+def download_game(game_id: int, full_pbp: bool = True, season: Union[int, None] = None) -> Dict:
+    """
+    Downloads every payload scrape_game needs for a game, without processing them.
+
+    Args:
+      game_id: Identifier ID for a given game.
+      full_pbp: Whether to download the shift data (the TH/TV reports and the shift chart).
+      season: Season of the game. Derived from the game ID when None.
+
+    Returns:
+      A dictionary with 'game_id', 'pbp_json' and 'shifts' ({source: payloads or None} for build_shifts).
+
+    Raises:
+      requests.exceptions.RequestException: If the play-by-play can't be downloaded.
+    """
+    return {'game_id': game_id, 'pbp_json': fetch_play_by_play_json(game_id),
+            'shifts': _download_shift_payloads(game_id, season) if full_pbp else {}}
+
+def _submit_shift_payloads(executor, game_id, season=None, sources=SHIFT_SOURCES):
+    # Futures of the raw shift payloads of the sources, {source: [futures]}
+    futures = {}
+    for source in sources:
+        if source == 'html':
+            futures[source] = [executor.submit(fetch_shift_report, game_id, True, season),
+                               executor.submit(fetch_shift_report, game_id, False, season)]
+        else:
+            futures[source] = [executor.submit(fetch_json, SHIFT_API_ENDPOINT.format(game_id=game_id))]
+    return futures
+
+def _shift_payload_results(futures):
+    # {source: payloads or None} from _submit_shift_payloads
+    shift_payloads = {}
+    for source, source_futures in futures.items():
+        try:
+            shift_payloads[source] = [future.result() for future in source_futures]
+        except requests.exceptions.RequestException:
+            shift_payloads[source] = None
+    return shift_payloads
+
+def _download_shift_payloads(game_id, season=None, sources=SHIFT_SOURCES):
+    # Raw shift payloads of the sources, {source: payloads or None}, downloaded concurrently
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        return _shift_payload_results(_submit_shift_payloads(executor, game_id, season, sources))
+
+def _build_downloaded_shifts(game_id, shift_payloads, pbp_json, season=None):
+    # Shifts from the first source of SHIFT_SOURCES with shift data, like fetch_shifts(source="auto").
+    # Sources missing from shift_payloads weren't downloaded yet (see _derived_inputs) and are downloaded here
+    for source in SHIFT_SOURCES:
+        payloads = shift_payloads[source] if source in shift_payloads else _download_shift_payloads(game_id, season, [source])[source]
+        if payloads is None:
+            continue
+        try:
+            return build_shifts(game_id, source, payloads, pbp_json, season)
+        except IndexError:
+            continue
+    raise IndexError('This game has no shift data.')
+
+def _scrape_downloaded(payloads, full_pbp=True, profile="full", season=None):
+    # CPU stage of ScrapePipeline, runs in a worker process. Returns (game_id, df, error, seconds)
+    started = time.perf_counter()
+    game_id = payloads['game_id']
+    try:
+        html_shifts = None
+        if full_pbp and profile != "events":
+            html_shifts = _build_downloaded_shifts(game_id, payloads['shifts'], payloads['pbp_json'], season)
+        df = scrape_game(game_id, pbp_json=payloads['pbp_json'], html_shifts=html_shifts, full_pbp=full_pbp, profile=profile)
+        return game_id, df, None, time.perf_counter() - started
+    except Exception as error:
+        return game_id, None, repr(error), time.perf_counter() - started
+
+class ScrapePipeline:
+    '''
+    Bulk scraper that overlaps the downloads of upcoming games with the processing of downloaded ones.
+
+    An I/O stage of io_workers threads downloads the payloads of each game (see download_game) into a
+    queue bounded to queue_size games. A CPU stage of cpu_workers processes takes games from the queue
+    and runs shift parsing and scrape_game on them. When the CPU stage falls behind, the full queue
+    pauses the downloads; when the downloads fall behind, the CPU stage waits on the empty queue.
+    Both waits are measured in stats() to size the pools.
+
+    Parameters
+    ----------
+    io_workers : int, optional
+        Number of download threads. The default is 8.
+    cpu_workers : int, optional
+        Number of processing processes. 1 processes in the current process. The default is os.cpu_count().
+    queue_size : int, optional
+        Maximum number of downloaded games waiting to be processed. The default is 16.
+    full_pbp, profile :
+        Passed to scrape_game. profile="events" skips the shift downloads.
+
+    Example
+    -------
+    >>> pipeline = ScrapePipeline(io_workers=8, cpu_workers=4)
+    >>> for game_id, df in pipeline.run(game_ids):
+    ...     df.to_parquet(f'{game_id}.parquet')
+    >>> pipeline.stats()
+    '''
+
+    def __init__(self, io_workers: int = 8, cpu_workers: Union[int, None] = None, queue_size: int = 16,
+                 full_pbp: bool = True, profile: str = "full"):
+        self.io_workers = io_workers
+        self.cpu_workers = os.cpu_count() or 1 if cpu_workers is None else cpu_workers
+        self.queue_size = queue_size
+        self.full_pbp = full_pbp
+        self.profile = profile
+        self.failed = {}
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._stats = {stage: {'games': 0, 'failed': 0, 'busy_s': 0.0, 'wait_s': 0.0} for stage in ['io', 'cpu']}
+        self._stats_lock = threading.Lock()
+        self._wall = {}
+
+    def _count(self, stage, failed, busy, waited):
+        with self._stats_lock:
+            stats = self._stats[stage]
+            stats['games'] += 1
+            stats['failed'] += int(failed)
+            stats['busy_s'] += busy
+            stats['wait_s'] += waited
+
+    @staticmethod
+    def _put(downloaded, item, stop):
+        # Blocks on the full queue until there is room or the run is stopped. Returns False when stopped
+        while not stop.is_set():
+            try:
+                downloaded.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _download_worker(self, game_ids, games_lock, downloaded, stop):
+        # Each I/O thread pulls the next game ID, downloads it and blocks on the full queue (wait_s)
+        while not stop.is_set():
+            with games_lock:
+                game_id = next(game_ids, None)
+            if game_id is None:
+                self._put(downloaded, None, stop)
+                return
+
+            started = time.perf_counter()
+            try:
+                item = download_game(game_id, full_pbp=self.full_pbp and self.profile != "events")
+            except Exception as error:
+                item = {'game_id': game_id, 'error': repr(error)}
+            busy = time.perf_counter() - started
+
+            started = time.perf_counter()
+            if not self._put(downloaded, item, stop):
+                return
+            self._count('io', 'error' in item, busy, time.perf_counter() - started)
+
+    def run(self, game_ids: List[int]):
+        '''
+        Scrape games, yielding (game_id, df) in completion order. Games that failed are left out
+        and their errors are kept in self.failed.
+        '''
+        self.failed = {}
+        self._reset_stats()
+        self._wall['started'] = time.perf_counter()
+
+        downloaded, stop = queue.Queue(maxsize=self.queue_size), threading.Event()
+        game_ids, games_lock = iter(list(game_ids)), threading.Lock()
+        threads = [threading.Thread(target=self._download_worker, args=(game_ids, games_lock, downloaded, stop), daemon=True)
+                   for _ in range(self.io_workers)]
+        for thread in threads:
+            thread.start()
+
+        process = functools.partial(_scrape_downloaded, full_pbp=self.full_pbp, profile=self.profile)
+        # spawn, so workers never inherit locks held by the download threads at fork time
+        executor = (ProcessPoolExecutor(max_workers=self.cpu_workers, mp_context=multiprocessing.get_context('spawn'))
+                    if self.cpu_workers > 1 else None)
+        pending, running_downloads = set(), self.io_workers
+
+        def finish(result):
+            game_id, df, error, seconds = result
+            self._count('cpu', error is not None, seconds, 0.0)
+            if error is not None:
+                self.failed[game_id] = error
+            return game_id, df, error
+
+        try:
+            while running_downloads or pending:
+                # Keep at most 2 games per process in flight, the rest waits in the bounded queue
+                while running_downloads and len(pending) < 2 * self.cpu_workers:
+                    started = time.perf_counter()
+                    try:
+                        item = downloaded.get(timeout=0.05 if pending else None)
+                    except queue.Empty:
+                        break
+                    finally:
+                        with self._stats_lock:
+                            self._stats['cpu']['wait_s'] += time.perf_counter() - started
+
+                    if item is None:
+                        running_downloads -= 1
+                    elif 'error' in item:
+                        self.failed[item['game_id']] = item['error']
+                    elif executor is None:
+                        game_id, df, error = finish(process(item))
+                        if error is None:
+                            yield game_id, df
+                    else:
+                        pending.add(executor.submit(process, item))
+
+                # Block on the processes when no more games can be taken from the queue, poll otherwise
+                done = {future for future in pending if future.done()}
+                if not done and pending and (not running_downloads or len(pending) >= 2 * self.cpu_workers):
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.discard(future)
+                    game_id, df, error = finish(future.result())
+                    if error is None:
+                        yield game_id, df
+        finally:
+            self._wall['finished'] = time.perf_counter()
+            # The consumer may stop early: stop the download threads and release the ones blocked on the full queue
+            stop.set()
+            while True:
+                try:
+                    downloaded.get_nowait()
+                except queue.Empty:
+                    break
+            if executor is not None:
+                # Games submitted but not started are dropped (cancel_futures needs Python 3.9)
+                for future in pending:
+                    future.cancel()
+                executor.shutdown(wait=True)
+
+    def stats(self) -> pd.DataFrame:
+        '''
+        Per-stage counters of the last run: games, failed, busy_s (summed over workers), wait_s (I/O threads
+        blocked on the full queue, CPU stage waiting on the empty queue), games_per_s and utilization
+        (busy_s / (wall_s * workers)).
+        '''
+        wall = self._wall.get('finished', time.perf_counter()) - self._wall.get('started', time.perf_counter())
+        stats = pd.DataFrame(self._stats).T.rename_axis('stage')
+        stats['workers'] = [self.io_workers, self.cpu_workers]
+        stats['wall_s'] = wall
+        stats['games_per_s'] = stats['games'] / wall if wall > 0 else np.nan
+        stats['utilization'] = stats['busy_s'] / (wall * stats['workers']) if wall > 0 else np.nan
+        return stats
+
+BATCH_RETRY_MODES = ['retryable', 'all', 'none']
+
+def _batch_checkpoint_path(checkpoint_dir):
+    return os.path.join(checkpoint_dir, 'checkpoint.pkl')
+
+def _batch_result_path(checkpoint_dir, game_id):
+    return os.path.join(checkpoint_dir, 'games', f"{game_id}.pkl")
+
+def load_batch_checkpoint(checkpoint_dir: str) -> Dict:
+    """
+    Reads the checkpoint of run_batch.
+
+    Returns:
+      A dictionary with 'done' (list of game IDs) and 'failed' ({game_id: {'error', 'retryable', 'attempts'}}).
+    """
+    path = _batch_checkpoint_path(checkpoint_dir)
+    if not os.path.exists(path):
+        return {'done': [], 'failed': {}}
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def run_batch(game_ids: List[int], checkpoint_dir: str, max_attempts: int = 3,
+              retry_errors: tuple = (requests.exceptions.RequestException,), backoff_seconds: float = 1.0,
+              retry_failed: str = 'retryable', **scrape_kwargs) -> Dict:
+    """
+    Scrapes games with scrape_game, checkpointing after every game so an interrupted run resumes where it stopped.
+
+    Each result is written to {checkpoint_dir}/games/{game_id}.pkl, then {checkpoint_dir}/checkpoint.pkl
+    (finished games and failures) is replaced atomically, so a crash never loses more than the game
+    in progress. On restart, finished games are skipped and failures are retried according to retry_failed.
+
+    Args:
+      game_ids: Games to scrape.
+      checkpoint_dir: Directory of the results and the checkpoint.
+      max_attempts: Attempts per game, over all runs.
+      retry_errors: Exception types worth retrying (e.g. network errors). They are retried within the run
+        with exponential backoff; other errors (e.g. IndexError, no shift data) fail the game right away.
+      backoff_seconds: Wait before the first retry, doubled after each attempt.
+      retry_failed: Failures of previous runs to retry: 'retryable' (those with a retry_errors error),
+        'all', or 'none'. Games that used max_attempts are never retried.
+      **scrape_kwargs: Passed to scrape_game.
+
+    Returns:
+      A dictionary with 'done' (games scraped in this run), 'failed' (every failure in the checkpoint,
+      as a dataframe with game_id, error, retryable and attempts) and 'skipped' (games finished in a previous run).
+    """
+    if retry_failed not in BATCH_RETRY_MODES:
+        raise ValueError(f"retry_failed must be one of {BATCH_RETRY_MODES}.")
+    os.makedirs(os.path.join(checkpoint_dir, 'games'), exist_ok=True)
+    checkpoint = load_batch_checkpoint(checkpoint_dir)
+    finished = set(checkpoint['done'])
+
+    done, skipped = [], []
+    for game_id in game_ids:
+        if game_id in finished:
+            skipped.append(game_id)
+            continue
+
+        failure = checkpoint['failed'].get(game_id)
+        attempts = 0 if failure is None else failure['attempts']
+        if failure is not None and (retry_failed == 'none' or (retry_failed == 'retryable' and not failure['retryable'])):
+            continue
+
+        while attempts < max_attempts:
+            attempts += 1
+            try:
+                result = scrape_game(game_id, **scrape_kwargs)
+            except Exception as error:
+                retryable = isinstance(error, retry_errors)
+                checkpoint['failed'][game_id] = {'error': repr(error), 'retryable': retryable, 'attempts': attempts}
+                _atomic_pickle(checkpoint, _batch_checkpoint_path(checkpoint_dir))
+                if not retryable:
+                    break
+                if attempts < max_attempts:
+                    time.sleep(backoff_seconds * 2 ** (attempts - 1))
+            else:
+                _atomic_pickle(result, _batch_result_path(checkpoint_dir, game_id))
+                checkpoint['failed'].pop(game_id, None)
+                checkpoint['done'].append(game_id)
+                finished.add(game_id)
+                _atomic_pickle(checkpoint, _batch_checkpoint_path(checkpoint_dir))
+                done.append(game_id)
+                break
+
+    failed = pd.DataFrame([{'game_id': game_id, **failure} for game_id, failure in checkpoint['failed'].items()],
+                          columns=['game_id', 'error', 'retryable', 'attempts'])
+    return {'done': done, 'failed': failed, 'skipped': skipped}
+
+def load_batch_results(checkpoint_dir: str, game_ids: Union[List[int], None] = None) -> Dict:
+    """
+    Reads the results of run_batch.
+
+    Args:
+      checkpoint_dir: Directory given to run_batch.
+      game_ids: Games to read. Defaulted to None, meaning every finished game.
+
+    Returns:
+      A dictionary {game_id: scrape_game output}.
+    """
+    game_ids = load_batch_checkpoint(checkpoint_dir)['done'] if game_ids is None else game_ids
+    results = {}
+    for game_id in game_ids:
+        with open(_batch_result_path(checkpoint_dir, game_id), 'rb') as f:
+            results[game_id] = pickle.load(f)
+    return results
+
+#Shot features
+SHOT_EVENTS = ['shot-on-goal', 'missed-shot', 'blocked-shot', 'goal']
+
+SHOT_TYPES = ['wrist', 'snap', 'slap', 'backhand', 'tip-in', 'deflected', 'wrap-around', 'poke', 'bat', 'between-legs', 'cradle']
+
+SHOT_FEATURES = ['x', 'y', 'distance', 'angle', 'period', 'elapsedTime', 'skaters', 'opponents',
+                 'score_diff', 'time_since_last', 'shotType']
+
+# Features taken from the shooting team's point of view, NaN when the shot has no team
+SHOT_SIDE_FEATURES = ['x', 'y', 'distance', 'angle', 'skaters', 'opponents', 'score_diff']
+
+# Attacked net, once coordinates are normalized so the shooting team attacks towards +x
+NET_X, NET_Y = 89, 0
+
+def build_shot_features(games, events: Union[List[str], None] = None) -> Dict:
+    """
+    Builds a float32 feature matrix of the shots of one or many games, for model training.
+
+    Coordinates are flipped so the shooting team always attacks the net at (NET_X, NET_Y), using
+    homeTeamDefendingSide. Score state is the shooting team's lead before the event (scores are only
+    set on goals, so they are forward-filled within each game), and time_since_last is the elapsed
+    time since the previous event of the game. skaters/opponents need the strength columns of
+    scrape_game(full_pbp=True) and are NaN otherwise. shotType is its code in SHOT_TYPES, -1 when missing.
+    Shots without a shooting team (is_home missing) have NaN for every SHOT_SIDE_FEATURES column.
+
+    Args:
+      games: A play-by-play dataframe from scrape_game (one or several games concatenated),
+        or a list of such dataframes and/or game IDs (scraped with scrape_game).
+      events: Events to keep. Defaulted to None, meaning SHOT_EVENTS.
+
+    Returns:
+      A dictionary with 'X' (float32, one row per shot, one column per SHOT_FEATURES), 'y' (int8, 1 for goals),
+      'columns' (SHOT_FEATURES), 'shot_types' (SHOT_TYPES, the shotType codes) and 'index' (game_id, event
+      and the row position of each shot in the play-by-play).
+    """
+    if isinstance(games, pd.DataFrame):
+        df = games
+    else:
+        df = pd.concat([scrape_game(game) if not isinstance(game, pd.DataFrame) else game for game in games], ignore_index=True)
+
+    game_ids = df['game_id'].to_numpy()
+    new_game = np.append(True, game_ids[1:] != game_ids[:-1])
+    by_game = df.groupby(game_ids, sort=False)
+
+    # Score before each event: goals carry the score after the goal, so forward-fill and lag by one event
+    home_score = by_game['homeScore'].ffill().groupby(game_ids, sort=False).shift(1).fillna(0).to_numpy(dtype=float)
+    away_score = by_game['awayScore'].ffill().groupby(game_ids, sort=False).shift(1).fillna(0).to_numpy(dtype=float)
+    elapsed = pd.to_numeric(df['elapsedTime'], errors='coerce').to_numpy(dtype=float)
+    time_since_last = np.where(new_game, np.nan, elapsed - np.roll(elapsed, 1))
+
+    events = SHOT_EVENTS if events is None else events
+    rows = np.flatnonzero(df['event'].isin(events).to_numpy())
+    shots = df.iloc[rows]
+
+    is_home = shots['is_home'].to_numpy(dtype=float) == 1
+    home_defends_left = (shots['homeTeamDefendingSide'].astype(object) == 'left').to_numpy()
+    # Home attacks +x when it defends the left net, the away team attacks the other way
+    sign = np.where(is_home == home_defends_left, 1.0, -1.0)
+    x = shots['xCoord'].to_numpy(dtype=float) * sign
+    y = shots['yCoord'].to_numpy(dtype=float) * sign
+
+    if 'home_skaters' in shots.columns:
+        home_skaters = pd.to_numeric(shots['home_skaters'], errors='coerce').to_numpy(dtype=float)
+        away_skaters = pd.to_numeric(shots['away_skaters'], errors='coerce').to_numpy(dtype=float)
+    else:
+        home_skaters = away_skaters = np.full(len(shots), np.nan)
+
+    shot_type = pd.Categorical(shots['shotType'].astype(object), categories=SHOT_TYPES).codes
+
+    features = {'x': x,
+                'y': y,
+                'distance': np.hypot(NET_X - x, y - NET_Y),
+                'angle': np.degrees(np.arctan2(np.abs(y - NET_Y), NET_X - x)),
+                'period': shots['period'].to_numpy(dtype=float),
+                'elapsedTime': elapsed[rows],
+                'skaters': np.where(is_home, home_skaters, away_skaters),
+                'opponents': np.where(is_home, away_skaters, home_skaters),
+                'score_diff': np.where(is_home, 1, -1) * (home_score[rows] - away_score[rows]),
+                'time_since_last': time_since_last[rows],
+                'shotType': shot_type}
+
+    # Events without a shooting team have no side to normalize against
+    no_side = shots['is_home'].isna().to_numpy()
+    for column in SHOT_SIDE_FEATURES:
+        features[column] = np.where(no_side, np.nan, features[column])
+
+    X = np.empty((len(rows), len(SHOT_FEATURES)), dtype=np.float32)
+    for i, column in enumerate(SHOT_FEATURES):
+        X[:, i] = features[column]
+
+    return {'X': X,
+            'y': (shots['event'] == 'goal').to_numpy().astype(np.int8),
+            'columns': list(SHOT_FEATURES),
+            'shot_types': list(SHOT_TYPES),
+            'index': pd.DataFrame({'game_id': game_ids[rows], 'event': shots['event'].to_numpy(), 'row': rows})}
+
+
 #Get the TOI per player per strength for a given game.
-def get_strength_toi_per_team(game_id=2023020005, game_rosters: Union[pd.DataFrame, None] = None, html_shifts: Union[pd.DataFrame, None] = None):
+def get_strength_toi_per_team(game_id=2023020005, game_rosters: Union[pd.DataFrame, None] = None, html_shifts: Union[pd.DataFrame, None] = None,
+                              cache_dir: Union[str, None] = None, archive: Union['PayloadArchive', None] = None,
+                              pbp_json: Union[Dict, None] = None):
 
     ''' 
     Get the TOI per strength for a given game.
@@ -1454,36 +2789,47 @@ def get_strength_toi_per_team(game_id=2023020005, game_rosters: Union[pd.DataFra
         Shifts dataframe. The default is None.
     is_home : bool, optional
         Whether to get the home or away players. The default is True.
+    cache_dir : Union[str, None], optional
+        Directory of the derived-result cache, see scrape_game. The default is None (no cache).
+    archive : Union[PayloadArchive, None], optional
+        Archive of the payloads, see scrape_game. The default is None.
+    pbp_json : Union[Dict, None], optional
+        Play-by-play JSON for game, for the team names. The default is None.
     '''
 
-    html_shifts = fetch_html_shifts2(game_id) if html_shifts is None else html_shifts
-    game_rosters = fetch_game_rosters(game_id) if game_rosters is None else game_rosters
+    if cache_dir is not None:
+        pbp_json, shift_payloads = _derived_inputs(game_id, pbp_json, html_shifts, archive=archive)
 
-    is_home = 1
-    place = 'home' if is_home else 'away'
-    not_place = 'away' if is_home else 'home'
+        def compute():
+            shifts = _build_downloaded_shifts(game_id, shift_payloads, pbp_json) if shift_payloads is not None else html_shifts
+            return [get_strength_toi_per_team(game_id, game_rosters, shifts, pbp_json=pbp_json)]
 
-    home_player_counts = get_player_count_per_second(game_id, html_shifts=html_shifts, is_home=1) #Gotta work on a fix with game_rosters
-    away_player_counts = get_player_count_per_second(game_id, html_shifts=html_shifts, is_home=(0)) #Gotta work on a fix with game_rosters
+        return _cached_frames(cache_dir, _derived_key('get_strength_toi_per_team', game_id,
+                                                      [pbp_json, game_rosters, html_shifts, shift_payloads], {}), compute)[0]
 
-    df = home_player_counts.merge(away_player_counts, on=["Second", "game_id"], how="left")
+    pbp_json = fetch_play_by_play_json(game_id) if pbp_json is None else pbp_json
+    html_shifts = fetch_shifts(game_id, pbp_json=pbp_json) if html_shifts is None else html_shifts
+
+    # Skater counts of every second, over the home team's game length like the per-second counts
+    _, home_occupancy = _skater_occupancy(html_shifts, 'home')
+    _, away_occupancy = _skater_occupancy(html_shifts, 'away', home_occupancy.shape[1])
+    home_counts, away_counts = home_occupancy.sum(axis=0), away_occupancy.sum(axis=0)
 
-    df['is_home2'] = 1 if is_home else 0
-    df['home_strength'] = df.apply(lambda row: f'{row[f"{place}Count"]}v{row[f"{not_place}Count"]}', axis=1)
-    df['away_strength'] = df.apply(lambda row: f'{row[f"{not_place}Count"]}v{row[f"{place}Count"]}', axis=1)
+    df = pd.DataFrame({'home_strength': strength_state(home_counts, away_counts),
+                       'away_strength': strength_state(away_counts, home_counts)})
 
     df = pd.concat([(df.home_strength
             .value_counts()
+            .loc[lambda x: x > 0]
             .reset_index()
             .assign(is_home=1)
             .rename(columns={"home_strength" : "strength", "count" : "TOI"})),
             (df.away_strength
             .value_counts()
+            .loc[lambda x: x > 0]
             .reset_index()
             .assign(is_home=0)
             .rename(columns={"away_strength" : "strength", "count" : "TOI"}))])
-    
-    pbp_json = fetch_play_by_play_json(game_id)
 
     df["abbrev"] = pbp_json['homeTeam']["abbrev"]
     df["name"] = pbp_json['homeTeam']["name"]
@@ -1493,12 +2839,19 @@ def get_strength_toi_per_team(game_id=2023020005, game_rosters: Union[pd.DataFra
 
     df["game_id"] = game_id
 
-    df = df.query("strength not in ['0v0']").reset_index(drop=True)
+    df = df.reset_index(drop=True)
 
     
     return df
 
 #TOI Manips
+def _skater_occupancy(shifts, place, n_seconds=None):
+    # Skaters of one side and their per-second occupancy (start <= second < end), over the side's last shift end by default
+    codes, players, start, end = _shift_arrays(shifts, [place], positive_only=False)
+    n_seconds = int(end.max(initial=0)) if n_seconds is None else n_seconds
+    skaters = players['positionCode'].isin(SKATER_POSITIONS).to_numpy()
+    return players[skaters].reset_index(drop=True), shift_occupancy(codes, start, end, n_seconds)[skaters]
+
 def get_player_count_per_second(game_id=2023020005, game_rosters: Union[pd.DataFrame, None] = None, html_shifts: Union[pd.DataFrame, None] = None, is_home=True):
     '''
     Get the number of players on the ice per second for a given game.
@@ -1517,31 +2870,16 @@ def get_player_count_per_second(game_id=2023020005, game_rosters: Union[pd.DataF
 
     place = 'home' if is_home else 'away'
 
-    html_shifts = fetch_html_shifts2(game_id) if html_shifts is None else html_shifts
-    game_rosters = fetch_game_rosters(game_id) if game_rosters is None else game_rosters
-
-    
-
-    df = html_shifts.copy().query("is_home==@is_home")
-
-    # Create a time-based range
-    game_duration = df['endTime_s'].max()  # Assumes the endTime_s column represents the game duration
-    time_range = range(game_duration)  # +1 to include the last second
+    html_shifts = fetch_shifts(game_id) if html_shifts is None else html_shifts
 
-    # Create a DataFrame with all seconds in the game
-    time_df = pd.DataFrame({'Second': time_range})
+    # Skaters on the ice each second, up to the team's last shift end
+    _, occupancy = _skater_occupancy(html_shifts, place)
 
-    # Calculate player counts for each second
-    def count_players_on_ice(second):
-        on_ice = df[(second >= df['startTime_s']) & (second < df['endTime_s'])
-                    & (df['positionCode'].isin(['C', 'D', 'L', 'R']))]['sweaterNumber'].nunique()  # Adjust position codes as needed
-        return on_ice
-
-    time_df[f'{place}Count'] = time_df['Second'].apply(count_players_on_ice)
+    time_df = pd.DataFrame({'Second': np.arange(occupancy.shape[1]),
+                            f'{place}Count': occupancy.sum(axis=0)})
 
     time_df["game_id"] = game_id
 
-    # Print the resulting DataFrame
     return time_df
 
 def get_player_ids_per_second(game_id=2023020005, game_rosters: Union[pd.DataFrame, None] = None, html_shifts: Union[pd.DataFrame, None] = None, is_home=True):
@@ -1561,39 +2899,26 @@ def get_player_ids_per_second(game_id=2023020005, game_rosters: Union[pd.DataFra
         Whether to get the home or away players. The default is True.
 
     '''
-    html_shifts = fetch_html_shifts2(game_id) if html_shifts is None else html_shifts
-    game_rosters = fetch_game_rosters(game_id) if game_rosters is None else game_rosters
+    html_shifts = fetch_shifts(game_id) if html_shifts is None else html_shifts
 
     place = 'home' if is_home else 'away'
 
-    df = html_shifts.copy().query("is_home==@is_home")
-    
-    # Create a time-based range
-    game_duration = df['endTime_s'].max()  # Assumes the endTime_s column represents the game duration
-    time_range = range(game_duration)  # +1 to include the last second
-
-    # Create an empty list to store the sweater numbers per second
-    playerId_per_second = []
-
-    # Iterate through each second and collect sweater numbers
-    for second in time_range:
-        on_ice = df[(second >= df['startTime_s']) & (second < df['endTime_s'])
-                    & (df['positionCode'].isin(['C', 'D', 'L', 'R']))] # Adjust position codes as needed
-        playerId = list(set(on_ice['playerId'].tolist()))
-        playerId_per_second.append(playerId)
+    # Skaters on the ice each second, up to the team's last shift end, split into one list per second
+    players, occupancy = _skater_occupancy(html_shifts, place)
+    n_seconds = occupancy.shape[1]
+    seconds, player_pos = np.nonzero(occupancy.T)
+    player_ids = players['playerId'].to_numpy()[player_pos]
+    per_second = np.split(player_ids, np.searchsorted(seconds, np.arange(1, n_seconds))) if n_seconds else []
 
-    # Create a DataFrame with all seconds in the game
-    time_df = pd.DataFrame({'Second': time_range})
-
-    time_df[f'{place}Players'] = playerId_per_second
+    time_df = pd.DataFrame({'Second': np.arange(n_seconds),
+                            f'{place}Players': [ids.tolist() for ids in per_second]})
 
     time_df["game_id"] = game_id
 
-
-    # Print the resulting list
     return time_df
 
-def players_toi_per_strength(game_id=2023020005, game_rosters: Union[pd.DataFrame, None] = None, html_shifts: Union[pd.DataFrame, None] = None, is_home=True):
+def players_toi_per_strength(game_id=2023020005, game_rosters: Union[pd.DataFrame, None] = None, html_shifts: Union[pd.DataFrame, None] = None, is_home=True,
+                             cache_dir: Union[str, None] = None, archive: Union['PayloadArchive', None] = None):
     '''
     Get the TOI per player per strength for a given game.
 
@@ -1607,37 +2932,1255 @@ def players_toi_per_strength(game_id=2023020005, game_rosters: Union[pd.DataFram
         Shifts dataframe. The default is None.
     is_home : bool, optional
         Whether to get the home or away players. The default is True.
+    cache_dir : Union[str, None], optional
+        Directory of the derived-result cache, see scrape_game. The default is None (no cache).
+    archive : Union[PayloadArchive, None], optional
+        Archive of the payloads, see scrape_game. The default is None.
     '''
 
-    html_shifts = fetch_html_shifts2(game_id) if html_shifts is None else html_shifts
+    if cache_dir is not None:
+        pbp_json, shift_payloads = _derived_inputs(game_id, None, html_shifts, need_pbp=game_rosters is None, archive=archive)
+
+        def compute():
+            shifts = _build_downloaded_shifts(game_id, shift_payloads, pbp_json) if shift_payloads is not None else html_shifts
+            rosters = fetch_game_rosters(game_id, pbp_json=pbp_json) if game_rosters is None else game_rosters
+            return [players_toi_per_strength(game_id, rosters, shifts, is_home)]
+
+        return _cached_frames(cache_dir, _derived_key('players_toi_per_strength', game_id, [pbp_json, game_rosters, html_shifts, shift_payloads],
+                                                      dict(is_home=bool(is_home))), compute)[0]
+
+    html_shifts = fetch_shifts(game_id) if html_shifts is None else html_shifts
     game_rosters = fetch_game_rosters(game_id) if game_rosters is None else game_rosters
     
     place = 'home' if is_home else 'away'
     not_place = 'away' if is_home else 'home'
 
-    
+    # Skater occupancy of both teams over the team's game length, strength of every second from the counts
+    players, occupancy = _skater_occupancy(html_shifts, place)
+    _, opponents = _skater_occupancy(html_shifts, not_place, occupancy.shape[1])
+    state = strength_state(occupancy.sum(axis=0), opponents.sum(axis=0))
 
-    df = get_player_ids_per_second(game_id, game_rosters=game_rosters, html_shifts=html_shifts, is_home=is_home)
-    df = df.explode(f'{place}Players')
+    player_seconds = occupancy.astype(np.int32) @ _state_one_hot(state)
+    player_pos, state_pos = np.nonzero(player_seconds)
 
-    home_player_counts = get_player_count_per_second(game_id, html_shifts=html_shifts, is_home=is_home) #Gotta work on a fix with game_rosters
-    away_player_counts = get_player_count_per_second(game_id, html_shifts=html_shifts, is_home=(not is_home)) #Gotta work on a fix with game_rosters
+    result = (pd.DataFrame({'playerId': players['playerId'].to_numpy(dtype=np.int64)[player_pos],
+                            'strength': pd.Categorical.from_codes(state_pos, categories=STRENGTH_STATES),
+                            'Seconds': player_seconds[player_pos, state_pos].astype(np.int64)})
+                .sort_values(['playerId', 'strength'])
+                .reset_index(drop=True))
 
-    df = df.merge(home_player_counts.merge(away_player_counts, on=["Second", "game_id"], how="left"), on=["Second", "game_id"], how="left")
+    result = result.merge(game_rosters.query("is_home==@is_home"), on="playerId", how="left")
 
-    df['is_home2'] = 1 if is_home else 0
-    df['strength'] = df.apply(lambda row: f'{row[f"{place}Count"]}v{row[f"{not_place}Count"]}', axis=1)
+    return result
 
-    result = (df.groupby([f'{place}Players', 'strength'], as_index=False)
-                .size()
-                .rename(columns={f'{place}Players': 'playerId',
-                                 'size': 'Seconds'}))
-    
-    result = result.merge(game_rosters.query("is_home==@is_home"), on="playerId", how="left")
-    result['strength'] = result['strength'].astype(str).str.replace('.0', '')
+#Season aggregation
+def _atomic_pickle(obj, path):
+    # Write to a temporary file first so readers never see a half-written pickle
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
 
-    # df2 = get_player_count_per_second(game_id=game_id, game_rosters=game_rosters,html_shifts=html_shifts,is_home=True).merge( get_player_count_per_second(game_id=game_id,html_shifts=html_shifts,is_home=False),  on=["Second", "game_id"], how="left")
+def fetch_season_game_ids(season: int = DEFAULT_SEASON, game_types: tuple = (2,), game_states: Union[List[str], None] = FINISHED_GAME_STATES) -> List[int]:
+    """
+    Lists the game IDs of a season from the schedules of every team.
 
+    Args:
+      season: Desired season in the format of {year_start}{year_end}.
+      game_types: Game types to keep (1 preseason, 2 regular season, 3 playoffs).
+      game_states: Game states to keep. None keeps every game.
 
-    return result
+    Returns:
+      A sorted list of unique game IDs.
+    """
+    game_ids = set()
+    for team_abbr in TEAM_ABBREVIATIONS:
+        for game in fetch_team_schedule_json(team_abbr, season).get('games', []):
+            if game.get('gameType') in game_types and (game_states is None or game.get('gameState') in game_states):
+                game_ids.add(game['id'])
+    return sorted(game_ids)
+
+def game_toi_partials(game_id: int, html_shifts: Union[pd.DataFrame, None] = None, cache_dir: Union[str, None] = None,
+                      archive: Union['PayloadArchive', None] = None) -> Dict:
+    """
+    Computes the per-game TOI by strength partial aggregates from the shift data.
+
+    Strength is taken from each team's point of view, with the skater counts of each second
+    (players at C, D, L or R with startTime_s <= second < endTime_s), like get_player_count_per_second.
+
+    Args:
+      game_id: Identifier ID for a given game.
+      html_shifts: Shifts dataframe or GameShifts. Fetched with fetch_shifts when None.
+      cache_dir: Directory of the derived-result cache (see scrape_game), keyed on the shift payloads or
+        the given html_shifts. Defaulted to None (no cache).
+      archive: With cache_dir, PayloadArchive the missing payloads are read from when it holds the game.
+
+    Returns:
+      A dictionary with 'players' (game_id, playerId, fullName, abbrev, is_home, strength, Seconds)
+      and 'teams' (game_id, abbrev, is_home, strength, TOI) dataframes.
+    """
+    if cache_dir is not None:
+        pbp_json, shift_payloads = _derived_inputs(game_id, None, html_shifts, need_pbp=False, archive=archive)
+
+        def compute():
+            shifts = _build_downloaded_shifts(game_id, shift_payloads, pbp_json) if shift_payloads is not None else html_shifts
+            return list(game_toi_partials(game_id, shifts).values())
+
+        frames = _cached_frames(cache_dir, _derived_key('game_toi_partials', game_id, [pbp_json, html_shifts, shift_payloads], {}),
+                                compute, n_parts=2)
+        return dict(zip(['players', 'teams'], frames))
+
+    html_shifts = fetch_shifts(game_id) if html_shifts is None else html_shifts
+    arrays = {is_home: _shift_arrays(html_shifts, ['home' if is_home else 'away'], positive_only=False, positions=SKATER_POSITIONS)
+              for is_home in [1, 0]}
+    n_seconds = int(max(end.max(initial=0) for _, _, _, end in arrays.values()))
+
+    sides = {}
+    for is_home in [1, 0]:
+        codes, side_players, start, end = arrays[is_home]
+        occupancy = shift_occupancy(codes, start, end, n_seconds)
+        sides[is_home] = (side_players, occupancy, occupancy.sum(axis=0))
+
+    players, teams = [], []
+    for is_home in [1, 0]:
+        side_players, occupancy, counts = sides[is_home]
+        state = strength_state(counts, sides[1 - is_home][2])
+
+        seconds_per_state = _state_one_hot(state)
+        player_seconds = occupancy.astype(np.int32) @ seconds_per_state
+
+        player_pos, state_pos = np.nonzero(player_seconds)
+        # First known abbreviation of the side, players missing from the rosters have none
+        abbrevs = side_players['abbrev'].dropna() if 'abbrev' in side_players.columns else []
+        abbrev = abbrevs.iloc[0] if len(abbrevs) else None
+        players.append(pd.DataFrame({'game_id': game_id,
+                                     'playerId': side_players['playerId'].to_numpy()[player_pos],
+                                     'fullName': side_players['fullName'].to_numpy()[player_pos],
+                                     'abbrev': abbrev,
+                                     'is_home': is_home,
+                                     'strength': pd.Categorical.from_codes(state_pos, categories=STRENGTH_STATES),
+                                     'Seconds': player_seconds[player_pos, state_pos]}))
+
+        team_seconds = seconds_per_state.sum(axis=0)
+        state_pos = np.flatnonzero(team_seconds)
+        teams.append(pd.DataFrame({'game_id': game_id,
+                                   'abbrev': abbrev,
+                                   'is_home': is_home,
+                                   'strength': pd.Categorical.from_codes(state_pos, categories=STRENGTH_STATES),
+                                   'TOI': team_seconds[state_pos]}))
+
+    return {'players': pd.concat(players, ignore_index=True), 'teams': pd.concat(teams, ignore_index=True)}
+
+def _game_toi_partials_or_error(game_id, cache_dir=None, archive_path=None):
+    # (partials, error): partials None and no error when the game has no shift data, repr of the error when it failed
+    try:
+        if archive_path is None:
+            return game_toi_partials(game_id, cache_dir=cache_dir), None
+        with PayloadArchive(archive_path) as archive:
+            return game_toi_partials(game_id, cache_dir=cache_dir, archive=archive), None
+    except IndexError: # This game has no shift data.
+        return None, None
+    except Exception as error:
+        return None, repr(error)
+
+def season_toi_by_strength(season: int = DEFAULT_SEASON, workers: int = 1, game_ids: Union[List[int], None] = None,
+                           cache_dir: Union[str, None] = None, archive_path: Union[str, None] = None) -> Dict:
+    """
+    Season-wide TOI by strength, per player and per team.
+
+    Each game is mapped to its partial aggregates (see game_toi_partials) on a pool of worker processes,
+    then the partials are reduced by summing the seconds. With cache_dir, games already aggregated are
+    read back from disk, so adding a new game only costs that game's work.
+
+    Args:
+      season: Desired season in the format of {year_start}{year_end}.
+      workers: Number of worker processes. 1 runs everything in the current process.
+      game_ids: Games to aggregate. Defaulted to None, meaning every finished regular season game.
+      cache_dir: Directory for the per-game partials. Defaulted to None (no cache).
+      archive_path: With cache_dir, path of a PayloadArchive the games' payloads are read from instead of
+        downloaded, so cached games make no request. Defaulted to None.
+
+    Returns:
+      A dictionary with 'players' (playerId, fullName, strength, Seconds, GP), 'teams' (abbrev, strength, TOI, GP),
+      'missing_games' (games without shift data) and 'failed' ({game_id: error} of the games that raised,
+      e.g. on a download or parsing error; they are left out and the other games still aggregated).
+    """
+    game_ids = fetch_season_game_ids(season) if game_ids is None else list(game_ids)
+    map_game = functools.partial(_game_toi_partials_or_error, cache_dir=cache_dir, archive_path=archive_path)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(map_game, game_ids))
+    else:
+        results = [map_game(game_id) for game_id in game_ids]
+
+    missing_games = [game_id for game_id, (partial, error) in zip(game_ids, results) if partial is None and error is None]
+    failed = {game_id: error for game_id, (_, error) in zip(game_ids, results) if error is not None}
+    partials = [partial for partial, _ in results if partial is not None]
+    if not partials:
+        return {'players': pd.DataFrame(), 'teams': pd.DataFrame(), 'missing_games': missing_games, 'failed': failed}
+
+    players = pd.concat([partial['players'] for partial in partials], ignore_index=True)
+    teams = pd.concat([partial['teams'] for partial in partials], ignore_index=True)
+
+    players = (players.groupby(['playerId', 'strength'], observed=True)
+                      .agg(fullName=('fullName', 'last'), Seconds=('Seconds', 'sum'), GP=('game_id', 'nunique'))
+                      .reset_index()[['playerId', 'fullName', 'strength', 'Seconds', 'GP']])
+    teams = (teams.groupby(['abbrev', 'strength'], observed=True)
+                  .agg(TOI=('TOI', 'sum'), GP=('game_id', 'nunique'))
+                  .reset_index())
+
+    return {'players': players, 'teams': teams, 'missing_games': missing_games, 'failed': failed}
+
+def game_shared_toi(game, team: str) -> Dict:
+    """
+    Seconds every pair of players of a team spent on the ice together in one game.
+
+    The game is cut into segments at the shift change points, O is the (players, segments) occupancy
+    and d the segment lengths, so the matrix is (O * d) @ O.T.
+
+    Args:
+      game: Game ID (shifts fetched with fetch_shifts), shifts dataframe or GameShifts.
+      team: Team abbreviation, or 'home'/'away'.
 
+    Returns:
+      A dictionary with 'matrix' (int64, players x players, the diagonal is each player's TOI) and
+      'players' (playerId, fullName) for its rows and columns.
+
+    Raises:
+      IndexError: If this game has no shift data.
+    """
+    shifts = game if isinstance(game, (pd.DataFrame, GameShifts)) else fetch_shifts(game)
+    codes, players, start, end = _shift_arrays(shifts)
+    team_players = _team_mask(players, team)
+    keep = team_players[codes]
+    # Codes of the team's players only
+    codes = (np.cumsum(team_players) - 1)[codes[keep]]
+    start, end = start[keep], end[keep]
+
+    boundaries = np.unique(np.concatenate([start, end]))
+    occupancy = np.zeros((int(team_players.sum()), max(len(boundaries) - 1, 0)), dtype=np.int64)
+    if len(codes):
+        segments = shift_occupancy(codes, np.searchsorted(boundaries, start), np.searchsorted(boundaries, end), len(boundaries) - 1)
+        occupancy[:len(segments)] = segments
+
+    players = players[team_players].reset_index(drop=True)
+    return {'matrix': (occupancy * np.diff(boundaries)) @ occupancy.T,
+            'players': players[['playerId'] + (['fullName'] if 'fullName' in players.columns else [])]}
+
+def _game_shared_toi_or_none(game, team):
+    try:
+        return game_shared_toi(game, team)
+    except IndexError: # This game has no shift data.
+        return None
+
+def shared_toi_matrix(games, team: str, workers: int = 1) -> Dict:
+    """
+    Pairwise shared TOI (with or without you) of a team's players over one or many games.
+
+    Each game is mapped to its matrix (see game_shared_toi) on a pool of worker processes, then the
+    matrices are summed on the union of the players.
+
+    Args:
+      games: Game ID, shifts dataframe or GameShifts, or a list of them (e.g. fetch_season_game_ids).
+      team: Team abbreviation ('home'/'away' only make sense for a single game).
+      workers: Number of worker processes. 1 runs everything in the current process.
+
+    Returns:
+      A dictionary with 'matrix' (int64, players x players seconds together, the diagonal is each
+      player's TOI), 'players' (playerId, fullName, GP) for its rows and columns, sorted by playerId,
+      and 'missing_games' (games without shift data).
+    """
+    games = [games] if isinstance(games, (int, np.integer, pd.DataFrame, GameShifts)) else list(games)
+    map_game = functools.partial(_game_shared_toi_or_none, team=team)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            partials = list(executor.map(map_game, games))
+    else:
+        partials = [map_game(game) for game in games]
+
+    missing_games = [game for game, partial in zip(games, partials) if partial is None]
+    partials = [partial for partial in partials if partial is not None]
+
+    players = (pd.concat([partial['players'] for partial in partials], ignore_index=True) if partials
+               else pd.DataFrame({'playerId': pd.Series(dtype=np.int64), 'fullName': pd.Series(dtype=object)}))
+    players = (players.groupby('playerId', sort=True)
+                      .agg(**({'fullName': ('fullName', 'last')} if 'fullName' in players.columns else {}), GP=('playerId', 'size'))
+                      .reset_index())
+
+    matrix = np.zeros((len(players), len(players)), dtype=np.int64)
+    for partial in partials:
+        positions = np.searchsorted(players['playerId'].to_numpy(), partial['players']['playerId'].to_numpy())
+        matrix[np.ix_(positions, positions)] += partial['matrix']
+
+    return {'matrix': matrix, 'players': players, 'missing_games': missing_games}
+
+#Derived-result cache
+def _payload_hash(payload) -> str:
+    # Content hash of an input: raw bytes, JSON payload, shifts/rosters dataframe, GameShifts or a list of those
+    digest = hashlib.sha1()
+    if payload is None:
+        digest.update(b'None')
+    elif isinstance(payload, bytes):
+        digest.update(payload)
+    elif isinstance(payload, (list, tuple)):
+        for item in payload:
+            digest.update(_payload_hash(item).encode())
+    elif isinstance(payload, GameShifts):
+        digest.update(payload.shifts.tobytes())
+        digest.update(_payload_hash(payload.players).encode())
+    elif isinstance(payload, pd.DataFrame):
+        digest.update(json.dumps([str(column) for column in payload.columns]).encode())
+        try:
+            digest.update(pd.util.hash_pandas_object(payload).to_numpy().tobytes())
+        except TypeError: # Unhashable cells, e.g. lists
+            digest.update(pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL))
+    else:
+        digest.update(json.dumps(payload, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+def _derived_key(name: str, game_id: int, inputs: List, params: Dict) -> str:
+    """
+    Key of a derived result in the cache.
+
+    Args:
+      name: Function that computes the result.
+      game_id: Identifier ID for a given game.
+      inputs: Payloads the result is computed from (see _payload_hash), None for the ones not given.
+      params: Parameters of the function that change the result.
+
+    Returns:
+      '{game_id}_{name}_{digest}', where the digest covers PIPELINE_VERSION, the parameters and the payloads.
+    """
+    digest = hashlib.sha1(json.dumps([PIPELINE_VERSION, name, params], sort_keys=True).encode())
+    for payload in inputs:
+        digest.update(_payload_hash(payload).encode())
+    return f"{game_id}_{name}_{digest.hexdigest()[:20]}"
+
+def _derived_inputs(game_id, pbp_json=None, html_shifts=None, need_pbp=True, need_shifts=True, archive=None):
+    # Payloads a derived result depends on and that weren't given, read from the archive when it holds
+    # the game, else downloaded (so without an archive a cache hit still takes the network time of the
+    # play-by-play and one shift source). Shifts are kept as raw payloads, only parsed on a cache miss.
+    # Only the shift source fetch_shifts(source="auto") would use is downloaded, and so keyed: the next
+    # source is tried when the download of one fails (None in shift_payloads). A source whose payloads
+    # hold no shifts only shows when they are parsed, _build_downloaded_shifts then downloads the next one.
+    # Returns (pbp_json or None, shift_payloads or None)
+    need_shifts = html_shifts is None and need_shifts
+    need_pbp = pbp_json is None and (need_pbp or need_shifts)
+    if not (need_pbp or need_shifts):
+        return pbp_json, None
+
+    if archive is not None and all((game_id, kind) in archive for kind in ARCHIVE_KINDS):
+        return (archive.pbp_json(game_id) if need_pbp else pbp_json,
+                {'html': [archive.get(game_id, 'home_report'), archive.get(game_id, 'away_report')]} if need_shifts else None)
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        pbp_future = executor.submit(fetch_play_by_play_json, game_id) if need_pbp else None
+        shift_payloads = None
+        if need_shifts:
+            shift_payloads = {}
+            for source in SHIFT_SOURCES:
+                shift_payloads.update(_shift_payload_results(_submit_shift_payloads(executor, game_id, sources=[source])))
+                if shift_payloads[source] is not None:
+                    break
+        return pbp_future.result() if pbp_future is not None else pbp_json, shift_payloads
+
+def _cached_frames(cache_dir: str, key: str, compute, n_parts: int = 1) -> List[pd.DataFrame]:
+    """
+    Reads the dataframes of a derived result from the cache, or computes and caches them.
+
+    Each dataframe is stored as {cache_dir}/{key}.{part}.parquet when pyarrow is installed (pickle for the
+    ones parquet can't store, e.g. mixed-type columns), {key}.{part}.pkl otherwise. Files are written
+    atomically, a partially written result is a miss.
+
+    Args:
+      cache_dir: Cache directory.
+      key: Key from _derived_key.
+      compute: Function returning the list of n_parts dataframes.
+      n_parts: Number of dataframes of the result.
+
+    Returns:
+      The list of dataframes.
+    """
+    paths = [os.path.join(cache_dir, f"{key}.{part}") for part in range(n_parts)]
+    frames = []
+    for path in paths:
+        if pyarrow is not None and os.path.exists(f"{path}.parquet"):
+            frames.append(pd.read_parquet(f"{path}.parquet"))
+        elif os.path.exists(f"{path}.pkl"):
+            with open(f"{path}.pkl", 'rb') as f:
+                frames.append(pickle.load(f))
+        else:
+            break
+    if len(frames) == n_parts:
+        return frames
+
+    frames = compute()
+    os.makedirs(cache_dir, exist_ok=True)
+    for path, frame in zip(paths, frames):
+        if pyarrow is not None:
+            tmp_path = f"{path}.parquet.tmp{os.getpid()}"
+            try:
+                frame.to_parquet(tmp_path)
+                os.replace(tmp_path, f"{path}.parquet")
+                continue
+            except (pyarrow.ArrowException, ValueError, TypeError):
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        _atomic_pickle(frame, f"{path}.pkl")
+    return frames
+
+#Schedule index
+SCHEDULE_COLUMNS = ['id', 'date', 'home', 'away', 'gameType', 'gameState']
+
+class ScheduleIndex:
+    '''
+    League-wide schedule of a season, one record per game (id, date, home, away, gameType, gameState).
+
+    The 32 team schedules are fetched concurrently and deduplicated on the game ID. Records are kept
+    in numpy arrays sorted by date, so date ranges are a binary search and team/state filters are
+    a mask over that range. With a path, the index is loaded from and saved to disk, and refresh()
+    only refetches the teams that still have unfinished games.
+
+    Parameters
+    ----------
+    season : int, optional
+        Season in the format of {year_start}{year_end}. The default is DEFAULT_SEASON.
+    path : str, optional
+        Pickle file where the index is persisted. The default is None (in memory only).
+    workers : int, optional
+        Number of concurrent schedule downloads. The default is 8.
+
+    Example
+    -------
+    >>> schedule = ScheduleIndex(20232024, path='schedule_20232024.pkl')
+    >>> schedule.refresh()
+    >>> schedule.game_ids(start='2023-11-01', end='2023-11-01', states=FINISHED_GAME_STATES)
+    '''
+
+    def __init__(self, season: int = DEFAULT_SEASON, path: Union[str, None] = None, workers: int = 8):
+        self.season = season
+        self.path = path
+        self.workers = workers
+        self.updated_at = None
+        self._records = {}
+
+        if path is not None and os.path.exists(path):
+            with open(path, 'rb') as f:
+                saved = pickle.load(f)
+            if saved['season'] == season:
+                self._records, self.updated_at = saved['records'], saved['updated_at']
+        self._build()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, game_id):
+        return int(game_id) in self._records
+
+    @staticmethod
+    def _record(game: Dict) -> tuple:
+        return (int(game['id']), game.get('gameDate'), game.get('homeTeam', {}).get('abbrev'),
+                game.get('awayTeam', {}).get('abbrev'), game.get('gameType'), game.get('gameState'))
+
+    def _build(self):
+        records = sorted(self._records.values(), key=lambda record: (record[1] or '', record[0]))
+        self._ids = np.array([record[0] for record in records], dtype=np.int64)
+        self._dates = np.array([record[1] for record in records], dtype='datetime64[D]')
+        self._game_types = np.array([-1 if record[4] is None else record[4] for record in records], dtype=np.int16)
+
+        # Teams and states as integer codes, so a lookup compares small ints instead of strings
+        self._team_codes = {team: code for code, team in enumerate(sorted({record[i] for record in records for i in (2, 3)} - {None}))}
+        self._home = np.array([self._team_codes.get(record[2], -1) for record in records], dtype=np.int16)
+        self._away = np.array([self._team_codes.get(record[3], -1) for record in records], dtype=np.int16)
+        self._state_codes = {state: code for code, state in enumerate(sorted({record[5] for record in records} - {None}))}
+        self._states = np.array([self._state_codes.get(record[5], -1) for record in records], dtype=np.int16)
+
+    def refresh(self, teams: Union[List[str], None] = None, force: bool = False) -> List[int]:
+        '''
+        Fetch team schedules and merge them into the index.
+
+        Parameters
+        ----------
+        teams : List[str], optional
+            Teams to refetch. The default is None, meaning every team on the first refresh or with force,
+            and afterwards only the teams with at least one game not in FINISHED_GAME_STATES.
+        force : bool, optional
+            Refetch every team, e.g. to pick up newly scheduled playoff games. The default is False.
+
+        Returns
+        -------
+        List[int] of the games that were added or changed.
+        '''
+        if teams is None:
+            if force or not self._records:
+                teams = TEAM_ABBREVIATIONS
+            else:
+                teams = sorted({team for record in self._records.values() if record[5] not in FINISHED_GAME_STATES
+                                for team in (record[2], record[3]) if team is not None})
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            schedules = list(executor.map(lambda team_abbr: fetch_team_schedule_json(team_abbr, self.season, conditional=True), teams))
+
+        changed = set()
+        for schedule in schedules:
+            for game in schedule.get('games', []):
+                record = self._record(game)
+                if self._records.get(record[0]) != record:
+                    self._records[record[0]] = record
+                    changed.add(record[0])
+
+        self.updated_at = datetime.now()
+        self._build()
+        self.save()
+        return sorted(changed)
+
+    def save(self):
+        '''Write the index to its path (no-op without a path).'''
+        if self.path is not None:
+            _atomic_pickle({'season': self.season, 'records': self._records, 'updated_at': self.updated_at}, self.path)
+
+    def _positions(self, start=None, end=None, team=None, states=None, game_types=None) -> np.ndarray:
+        lo = 0 if start is None else np.searchsorted(self._dates, np.datetime64(pd.Timestamp(start).date(), 'D'), side='left')
+        hi = len(self._dates) if end is None else np.searchsorted(self._dates, np.datetime64(pd.Timestamp(end).date(), 'D'), side='right')
+        mask = np.ones(max(hi - lo, 0), dtype=bool)
+
+        if team is not None:
+            code = self._team_codes.get(team, -2)
+            mask &= (self._home[lo:hi] == code) | (self._away[lo:hi] == code)
+        if states is not None:
+            mask &= np.isin(self._states[lo:hi], [self._state_codes.get(state, -2) for state in states])
+        if game_types is not None:
+            mask &= np.isin(self._game_types[lo:hi], list(game_types))
+
+        return lo + np.flatnonzero(mask)
+
+    def game_ids(self, start=None, end=None, team: Union[str, None] = None, states: Union[List[str], None] = None,
+                 game_types: Union[tuple, None] = None) -> List[int]:
+        '''
+        Game IDs matching every given filter, in date order.
+
+        Parameters
+        ----------
+        start, end : str or date, optional
+            Inclusive date range, e.g. '2023-11-01'. The default is None (unbounded).
+        team : str, optional
+            Team abbreviation, home or away. The default is None.
+        states : List[str], optional
+            Game states to keep, e.g. FINISHED_GAME_STATES. The default is None.
+        game_types : tuple, optional
+            Game types to keep (1 preseason, 2 regular season, 3 playoffs). The default is None.
+        '''
+        return self._ids[self._positions(start, end, team, states, game_types)].tolist()
+
+    def games(self, start=None, end=None, team: Union[str, None] = None, states: Union[List[str], None] = None,
+              game_types: Union[tuple, None] = None) -> pd.DataFrame:
+        '''Same filters as game_ids, returning the records as a dataframe with SCHEDULE_COLUMNS.'''
+        ids = self._ids[self._positions(start, end, team, states, game_types)]
+        return pd.DataFrame([self._records[game_id] for game_id in ids.tolist()], columns=SCHEDULE_COLUMNS)
+
+#Player registry
+class PlayerRegistry:
+    '''
+    Player metadata of many games keyed by playerId: names, position and headshot (latest game wins),
+    plus every appearance (game, team, sweater number) for sweater number history and team stints.
+
+    The registry is updated one game at a time from the game rosters and exposed as arrays sorted by
+    playerId, so enriching any number of IDs is one binary search and one gather.
+
+    Parameters
+    ----------
+    path : str, optional
+        Pickle file where the registry is persisted. The default is None (in memory only).
+
+    Example
+    -------
+    >>> registry = PlayerRegistry('players.pkl')
+    >>> for game_id in game_ids:
+    ...     registry.update(game_id)
+    >>> registry.save()
+    >>> df['event_player1_fullName'] = registry.lookup(df['event_player1_id'])
+    '''
+
+    ATTRIBUTES = ['firstName', 'lastName', 'fullName', 'positionCode', 'headshot']
+
+    def __init__(self, path: Union[str, None] = None):
+        self.path = path
+        self._players = {}
+        self._appearances = []
+        self._games = set()
+
+        if path is not None and os.path.exists(path):
+            with open(path, 'rb') as f:
+                saved = pickle.load(f)
+            self._players, self._appearances, self._games = saved['players'], saved['appearances'], saved['games']
+        self._built = False
+
+    def __len__(self):
+        return len(self._players)
+
+    def __contains__(self, player_id):
+        return int(player_id) in self._players
+
+    def game_ids(self) -> List[int]:
+        return sorted(self._games)
+
+    def update(self, game_id: int, pbp_json: Union[Dict, None] = None, game_rosters: Union[pd.DataFrame, None] = None) -> List[int]:
+        '''
+        Add the players of a game. A game already in the registry is skipped.
+
+        Parameters
+        ----------
+        game_id : int
+            Game ID.
+        pbp_json : Union[Dict, None], optional
+            Play-by-play JSON of the game, to build the rosters without a request. The default is None.
+        game_rosters : Union[pd.DataFrame, None], optional
+            Rosters from fetch_game_rosters. The default is None.
+
+        Returns
+        -------
+        List[int] of the players that were not in the registry.
+        '''
+        game_id = int(game_id)
+        if game_id in self._games:
+            return []
+        game_rosters = fetch_game_rosters(game_id, pbp_json=pbp_json) if game_rosters is None else game_rosters
+
+        new_players = []
+        columns = ['playerId', 'abbrev', 'sweaterNumber'] + self.ATTRIBUTES
+        for player in game_rosters.reindex(columns=columns).to_dict('records'):
+            player_id = int(player['playerId'])
+            known = self._players.get(player_id)
+            if known is None:
+                new_players.append(player_id)
+            # Attributes of the most recent game win, whatever the order games are added in
+            if known is None or known['game_id'] <= game_id:
+                self._players[player_id] = {'game_id': game_id, **{attribute: player[attribute] for attribute in self.ATTRIBUTES}}
+            self._appearances.append((player_id, game_id, player['abbrev'], player['sweaterNumber']))
+
+        self._games.add(game_id)
+        self._built = False
+        return new_players
+
+    def save(self):
+        '''Write the registry to its path (no-op without a path).'''
+        if self.path is not None:
+            _atomic_pickle({'players': self._players, 'appearances': self._appearances, 'games': self._games}, self.path)
+
+    def _build(self):
+        if self._built:
+            return
+        self._ids = np.array(sorted(self._players), dtype=np.int64)
+        self._columns = {attribute: np.array([self._players[player_id][attribute] for player_id in self._ids.tolist()], dtype=object)
+                         for attribute in self.ATTRIBUTES}
+        self._appearance_df = (pd.DataFrame(self._appearances, columns=['playerId', 'game_id', 'abbrev', 'sweaterNumber'])
+                               .sort_values(['playerId', 'game_id'], kind='stable', ignore_index=True))
+        self._built = True
+
+    def lookup(self, player_ids, column: str = 'fullName') -> np.ndarray:
+        '''
+        Gather one attribute (see ATTRIBUTES) for an array of player IDs. Missing or unknown IDs give None.
+        '''
+        self._build()
+        player_ids = pd.to_numeric(pd.Series(np.asarray(player_ids).ravel()), errors='coerce').to_numpy(dtype=float)
+        known = ~np.isnan(player_ids)
+        keys = np.where(known, player_ids, -1).astype(np.int64)
+
+        pos = np.minimum(np.searchsorted(self._ids, keys), max(len(self._ids) - 1, 0))
+        found = known & (self._ids[pos] == keys) if len(self._ids) else np.zeros(len(keys), dtype=bool)
+
+        values = np.full(len(keys), None, dtype=object)
+        values[found] = self._columns[column][pos[found]]
+        return values
+
+    def players(self) -> pd.DataFrame:
+        '''Current attributes of every player, sorted by playerId.'''
+        self._build()
+        return pd.DataFrame({'playerId': self._ids, **self._columns})
+
+    def _runs(self, keys: List[str], player_ids=None) -> pd.DataFrame:
+        # Consecutive games (by game ID) of a player with the same keys form one run
+        self._build()
+        df = self._appearance_df
+        if player_ids is not None:
+            df = df[df['playerId'].isin(list(np.atleast_1d(player_ids)))]
+        changed = (df['playerId'] != df['playerId'].shift()).to_numpy()
+        for key in keys:
+            changed |= (df[key] != df[key].shift()).to_numpy()
+        return (df.groupby(np.cumsum(changed))
+                  .agg(playerId=('playerId', 'first'), **{key: (key, 'first') for key in keys},
+                       first_game_id=('game_id', 'first'), last_game_id=('game_id', 'last'), GP=('game_id', 'size'))
+                  .reset_index(drop=True))
+
+    def stints(self, player_ids=None) -> pd.DataFrame:
+        '''Team stints (playerId, abbrev, first_game_id, last_game_id, GP), optionally for some players only.'''
+        return self._runs(['abbrev'], player_ids)
+
+    def sweater_history(self, player_ids=None) -> pd.DataFrame:
+        '''Sweater numbers worn by team (playerId, abbrev, sweaterNumber, first_game_id, last_game_id, GP).'''
+        return self._runs(['abbrev', 'sweaterNumber'], player_ids)
+
+#Raw payload archive
+ARCHIVE_KINDS = {'pbp': 0, 'home_report': 1, 'away_report': 2}
+
+_ARCHIVE_CODECS = {'zlib': 0, 'zstd': 1}
+
+_ARCHIVE_INDEX_DTYPE = np.dtype([('key', '<i8'), ('offset', '<i8'), ('length', '<i8'), ('codec', '<i8')])
+
+class PayloadArchive:
+    '''
+    Single-file archive of raw game payloads (play-by-play JSON, TH/TV shift reports).
+
+    Records are compressed (zstd when the zstandard package is installed, zlib otherwise) and appended
+    to {path}.data. {path}.idx holds a sorted offset index keyed by (game_id, kind) that is memory-mapped
+    on open, so reading a game is one index lookup, one seek and one decompress.
+
+    Parameters
+    ----------
+    path : str
+        Archive path without extension, e.g. 'archives/20232024'.
+    mode : str, optional
+        'r' to read, 'a' to read and append. The default is 'r'.
+
+    Example
+    -------
+    >>> with PayloadArchive('archives/20232024') as archive:
+    ...     df = scrape_game(game_id, pbp_json=archive.pbp_json(game_id), html_shifts=archive.html_shifts(game_id))
+    '''
+
+    def __init__(self, path: str, mode: str = 'r'):
+        self.path = path
+        self.mode = mode
+        self.data_path = f"{path}.data"
+        self.index_path = f"{path}.idx"
+        self._pending = []
+        self._load_index()
+        self._data = open(self.data_path, 'ab+' if mode == 'a' else 'rb')
+
+    def _load_index(self):
+        if os.path.exists(self.index_path) and os.path.getsize(self.index_path) > 0:
+            self._index = np.memmap(self.index_path, dtype=_ARCHIVE_INDEX_DTYPE, mode='r')
+        else:
+            self._index = np.zeros(0, dtype=_ARCHIVE_INDEX_DTYPE)
+        self._keys = np.asarray(self._index['key'])
+
+    @staticmethod
+    def _key(game_id, kind):
+        return int(game_id) * len(ARCHIVE_KINDS) + ARCHIVE_KINDS[kind]
+
+    def __contains__(self, item):
+        game_id, kind = item
+        key = self._key(game_id, kind)
+        pos = np.searchsorted(self._keys, key)
+        return (pos < len(self._keys) and self._keys[pos] == key) or any(entry[0] == key for entry in self._pending)
+
+    def game_ids(self) -> List[int]:
+        keys = np.concatenate([self._keys, np.array([entry[0] for entry in self._pending], dtype=np.int64)])
+        return sorted(set((keys // len(ARCHIVE_KINDS)).tolist()))
+
+    def add(self, game_id: int, kind: str, payload: bytes):
+        '''Append a raw payload. A payload added twice for the same (game_id, kind) replaces the previous one.'''
+        if self.mode != 'a':
+            raise ValueError("Archive opened read-only, use mode='a' to add payloads.")
+        if zstandard is not None:
+            codec, compressed = _ARCHIVE_CODECS['zstd'], zstandard.ZstdCompressor(level=10).compress(payload)
+        else:
+            codec, compressed = _ARCHIVE_CODECS['zlib'], zlib.compress(payload, 6)
+        self._data.seek(0, os.SEEK_END)
+        offset = self._data.tell()
+        self._data.write(compressed)
+        self._pending.append((self._key(game_id, kind), offset, len(compressed), codec))
+
+    def get(self, game_id: int, kind: str) -> bytes:
+        '''
+        Read one raw payload.
+
+        Raises
+        ------
+        KeyError if the payload is not in the archive.
+        '''
+        key = self._key(game_id, kind)
+        pending = [entry for entry in self._pending if entry[0] == key]
+        if pending:
+            _, offset, length, codec = pending[-1]
+        else:
+            pos = np.searchsorted(self._keys, key)
+            if pos >= len(self._keys) or self._keys[pos] != key:
+                raise KeyError((game_id, kind))
+            _, offset, length, codec = self._index[pos].tolist()
+
+        self._data.seek(offset)
+        compressed = self._data.read(length)
+        if codec == _ARCHIVE_CODECS['zstd']:
+            if zstandard is None:
+                raise ImportError("zstandard is required to read this archive.")
+            return zstandard.ZstdDecompressor().decompress(compressed)
+        return zlib.decompress(compressed)
+
+    def pbp_json(self, game_id: int) -> Dict:
+        '''Play-by-play JSON of a game, for the pbp_json= parameters.'''
+        return _json_loads(self.get(game_id, 'pbp'))
+
+    def html_shifts(self, game_id: int, pbp_json: Union[Dict, None] = None) -> pd.DataFrame:
+        '''Shifts of a game parsed from the archived TH/TV reports, for the html_shifts= parameters.'''
+        pbp_json = self.pbp_json(game_id) if pbp_json is None else pbp_json
+        return fetch_html_shifts2(game_id, pbp_json=pbp_json,
+                                  home_report=self.get(game_id, 'home_report'),
+                                  away_report=self.get(game_id, 'away_report'))
+
+    def flush(self):
+        '''Write the index of the payloads added since the last flush.'''
+        if not self._pending:
+            return
+        self._data.flush()
+        os.fsync(self._data.fileno())
+
+        index = np.concatenate([np.asarray(self._index), np.array(self._pending, dtype=_ARCHIVE_INDEX_DTYPE)])
+        # Stable sort then keep the last record of each key, so re-added payloads win
+        index = index[np.argsort(index['key'], kind='stable')]
+        last = np.append(index['key'][1:] != index['key'][:-1], True)
+        index = index[last]
+
+        tmp_path = f"{self.index_path}.tmp{os.getpid()}"
+        index.tofile(tmp_path)
+        del self._index
+        os.replace(tmp_path, self.index_path)
+        self._pending = []
+        self._load_index()
+
+    def close(self):
+        if self.mode == 'a':
+            self.flush()
+        self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def archive_games(path: str, game_ids: List[int], season: Union[int, None] = None) -> List[int]:
+    """
+    Downloads the raw play-by-play and shift reports of games into a PayloadArchive, skipping games already archived.
+
+    Args:
+      path: Archive path without extension.
+      game_ids: Games to archive.
+      season: Season of the games. Derived from each game ID when None.
+
+    Returns:
+      The list of game IDs that were added.
+
+    Raises:
+      requests.exceptions.RequestException: If a payload of a game can't be downloaded. Nothing of that game is archived.
+    """
+    added = []
+    with PayloadArchive(path, mode='a') as archive:
+        for game_id in game_ids:
+            if all((game_id, kind) in archive for kind in ARCHIVE_KINDS):
+                continue
+            response = _session.get(PLAY_BY_PLAY_ENDPOINT.format(game_id=game_id))
+            response.raise_for_status()
+            # Every payload is downloaded before any is added, so an error page is never archived
+            payloads = {'pbp': response.content,
+                        'home_report': fetch_shift_report(game_id, True, season),
+                        'away_report': fetch_shift_report(game_id, False, season)}
+            for kind, payload in payloads.items():
+                archive.add(game_id, kind, payload)
+            archive.flush()
+            added.append(game_id)
+    return added
+
+#Local storage
+STORE_TABLES = ['pbp', 'shifts', 'rosters']
+
+STORE_INDEXED_COLUMNS = ['game_id', 'playerId', 'event', 'season', 'strength', 'event_player1_id']
+
+# Materialized aggregates of GameStore: name -> (key columns, value column). Each has a {name}_by_game table
+# with the contribution of every game and a {name} table with the totals and the number of games (GP)
+# player_events strength is from the player's team point of view (flipped for event players of the other team)
+STORE_AGGREGATES = {'player_events': (['playerId', 'role', 'event', 'strength'], 'n'),
+                    'team_events': (['abbrev', 'event', 'strength'], 'n'),
+                    'player_toi': (['playerId', 'strength'], 'seconds'),
+                    'team_toi': (['abbrev', 'strength'], 'seconds')}
+
+def _sql_type(dtype):
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'REAL'
+    return 'TEXT'
+
+def _sql_records(df):
+    # Categories, datetimes and missing values converted to plain Python values sqlite3 can bind
+    df = df.copy()
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(object)
+        elif pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = df[column].astype(str)
+    df = df.astype(object).where(df.notna(), None)
+    return [tuple(value.item() if isinstance(value, np.generic) else value for value in row) for row in df.itertuples(index=False, name=None)]
+
+class GameStore:
+    '''
+    Embedded SQLite store for scraped play-by-play, shifts and rosters.
+
+    One table per kind (pbp, shifts, rosters), indexed on game_id, playerId, event, season, strength
+    and event_player1_id when the column exists. Saving a game replaces its previous rows (upsert per game),
+    new columns are added on the fly. By default the database runs in WAL mode so several processes of
+    one host can read while one writes; a store shared by several machines over a network filesystem
+    (e.g. the queue_worker one) must use journal_mode='DELETE', since WAL only works on one host.
+
+    Saving a game also maintains the STORE_AGGREGATES tables (events by strength per player and team,
+    TOI by strength per player and team): the game's previous contribution is subtracted from the totals
+    and the new one added, so saving a game costs the same whatever the size of the store, and saving it
+    again doesn't double count. Missing strengths are stored as 'NA'.
+
+    Parameters
+    ----------
+    path : str
+        Path of the database file.
+    journal_mode : str, optional
+        SQLite journal mode, 'WAL' or 'DELETE' (rollback journal, for a database shared between machines).
+        The default is 'WAL'.
+
+    Example
+    -------
+    >>> store = GameStore('nhl.db')
+    >>> store.scrape(2023020005)
+    >>> store.query("SELECT * FROM pbp WHERE event_player1_id = ? AND event = 'goal'", (8478402,))
+    '''
+
+    def __init__(self, path: str, journal_mode: str = 'WAL'):
+        if journal_mode.upper() not in ('WAL', 'DELETE'):
+            raise ValueError("journal_mode must be 'WAL' or 'DELETE'.")
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute(f'PRAGMA journal_mode={journal_mode.upper()}')
+
+    def _columns(self, table):
+        return [row[1] for row in self.conn.execute(f'PRAGMA table_info("{table}")')]
+
+    def _ensure_table(self, table, df):
+        existing = self._columns(table)
+        if not existing:
+            columns = ', '.join(f'"{column}" {_sql_type(df[column].dtype)}' for column in df.columns)
+            self.conn.execute(f'CREATE TABLE "{table}" ({columns})')
+        else:
+            for column in df.columns:
+                if column not in existing:
+                    self.conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {_sql_type(df[column].dtype)}')
+
+        for column in STORE_INDEXED_COLUMNS:
+            if column in df.columns:
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{table}_{column}" ON "{table}" ("{column}")')
+
+    def _replace_game(self, table, game_id, df):
+        df = df.loc[:, ~df.columns.duplicated()].assign(game_id=game_id)
+        self._ensure_table(table, df)
+        self.conn.execute(f'DELETE FROM "{table}" WHERE game_id = ?', (int(game_id),))
+        columns = ', '.join(f'"{column}"' for column in df.columns)
+        placeholders = ', '.join('?' for _ in df.columns)
+        self.conn.executemany(f'INSERT INTO "{table}" ({columns}) VALUES ({placeholders})', _sql_records(df))
+
+    def _ensure_aggregate(self, name):
+        keys, value = STORE_AGGREGATES[name]
+        key_columns = ', '.join(f'"{key}"' for key in keys)
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS "{name}_by_game" (game_id INTEGER, {key_columns}, "{value}" REAL)')
+        self.conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{name}_by_game_game_id" ON "{name}_by_game" (game_id)')
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS "{name}" ({key_columns}, "{value}" REAL, GP INTEGER, PRIMARY KEY ({key_columns}))')
+
+    def _replace_aggregate(self, name, game_id, df):
+        # Subtract the previous contribution of the game, then add the new one, in the caller's transaction
+        keys, value = STORE_AGGREGATES[name]
+        self._ensure_aggregate(name)
+        key_columns = ', '.join(f'"{key}"' for key in keys)
+        upsert = (f'ON CONFLICT ({key_columns}) DO UPDATE SET "{value}" = "{value}" + excluded."{value}", GP = GP + excluded.GP')
+
+        self.conn.execute(f'INSERT INTO "{name}" ({key_columns}, "{value}", GP) SELECT {key_columns}, -"{value}", -1 '
+                          f'FROM "{name}_by_game" WHERE game_id = ? {upsert}', (int(game_id),))
+        self.conn.execute(f'DELETE FROM "{name}_by_game" WHERE game_id = ?', (int(game_id),))
+
+        df = df[keys + [value]].assign(game_id=int(game_id))[['game_id'] + keys + [value]]
+        self.conn.executemany(f'INSERT INTO "{name}_by_game" (game_id, {key_columns}, "{value}") VALUES ({", ".join("?" * (len(keys) + 2))})',
+                              _sql_records(df))
+        self.conn.execute(f'INSERT INTO "{name}" ({key_columns}, "{value}", GP) SELECT {key_columns}, "{value}", 1 '
+                          f'FROM "{name}_by_game" WHERE game_id = ? {upsert}', (int(game_id),))
+        self.conn.execute(f'DELETE FROM "{name}" WHERE GP <= 0')
+
+    @staticmethod
+    def _event_aggregates(pbp, rosters=None):
+        strength = pbp['strength'].astype(object).where(pbp['strength'].notna(), 'NA') if 'strength' in pbp else 'NA'
+        events = pbp.assign(strength=strength)
+
+        # strength is from the event team's point of view, players of the other team (faceoff loser, hittee,
+        # blocker, goalie in net, penalty drawer...) get it flipped. Their team is the event_player{role}_team
+        # column of full scrapes, or looked up in the rosters.
+        teams = rosters.drop_duplicates('playerId').set_index('playerId')['abbrev'] if rosters is not None else None
+        flipped = {state: 'v'.join(state.split('v')[::-1]) for state in STRENGTH_STATES}
+
+        def player_rows(role):
+            rows = events[[f'event_player{role}_id', 'event', 'strength']].rename(columns={f'event_player{role}_id': 'playerId'})
+            if f'event_player{role}_team' in events:
+                team = events[f'event_player{role}_team']
+            elif teams is not None and 'event_team' in events:
+                team = rows['playerId'].map(teams)
+            else:
+                return rows.assign(role=role)
+            opponent = (team.notna() & events['event_team'].notna() & (team != events['event_team'])).to_numpy()
+            rows.loc[opponent, 'strength'] = rows.loc[opponent, 'strength'].map(lambda state: flipped.get(state, state))
+            return rows.assign(role=role)
+
+        players = pd.concat([player_rows(role) for role in [1, 2, 3]], ignore_index=True).dropna(subset=['playerId', 'event'])
+        players = players.astype({'playerId': np.int64}).groupby(['playerId', 'role', 'event', 'strength'], observed=True).size().rename('n').reset_index()
+
+        teams = (events.dropna(subset=['event_team', 'event']).rename(columns={'event_team': 'abbrev'})
+                       .groupby(['abbrev', 'event', 'strength'], observed=True).size().rename('n').reset_index())
+        return players, teams
+
+    def save_game(self, game_id: int, pbp: Union[pd.DataFrame, None] = None, shifts: Union[pd.DataFrame, None] = None,
+                  rosters: Union[pd.DataFrame, None] = None, aggregate: bool = True):
+        '''
+        Replace the rows of one game, in a single transaction.
+
+        Parameters
+        ----------
+        game_id : int
+            Game ID of the frames.
+        pbp : Union[pd.DataFrame, None], optional
+            scrape_game output. The default is None (left untouched).
+        shifts : Union[pd.DataFrame, None], optional
+            fetch_html_shifts2 / fetch_api_shifts output. The default is None (left untouched).
+        rosters : Union[pd.DataFrame, None], optional
+            fetch_game_rosters output. The default is None (left untouched).
+        aggregate : bool, optional
+            Whether to update the STORE_AGGREGATES tables, the events ones from pbp and the TOI ones from shifts.
+            The default is True.
+        '''
+        aggregates = {}
+        if aggregate and pbp is not None:
+            aggregates['player_events'], aggregates['team_events'] = self._event_aggregates(pbp, rosters)
+        if aggregate and shifts is not None:
+            partials = game_toi_partials(game_id, html_shifts=shifts)
+            if rosters is not None and 'abbrev' in rosters.columns:
+                # Team of a side without any abbreviation in the shifts, from the rosters
+                side_abbrevs = rosters.dropna(subset=['abbrev']).drop_duplicates('is_home').set_index('is_home')['abbrev']
+                for df in partials.values():
+                    df['abbrev'] = df['abbrev'].fillna(df['is_home'].map(side_abbrevs))
+            aggregates['player_toi'] = partials['players'].rename(columns={'Seconds': 'seconds'})
+            aggregates['team_toi'] = partials['teams'].rename(columns={'TOI': 'seconds'})
+
+        with self.conn:
+            for table, df in zip(STORE_TABLES, [pbp, shifts, rosters]):
+                if df is not None:
+                    self._replace_game(table, game_id, df)
+            for name, df in aggregates.items():
+                self._replace_aggregate(name, game_id, df)
+
+    def scrape(self, game_id: int):
+        '''Scrape a game (play-by-play, shifts and rosters) and save it.'''
+        pbp_json = fetch_play_by_play_json(game_id)
+        game_rosters = fetch_game_rosters(game_id, pbp_json=pbp_json)
+        html_shifts = fetch_shifts(game_id, pbp_json=pbp_json)
+        pbp = scrape_game(game_id, pbp_json=pbp_json, game_rosters=game_rosters, html_shifts=html_shifts)
+        self.save_game(game_id, pbp=pbp, shifts=html_shifts, rosters=game_rosters)
+
+    def aggregate(self, name: str) -> pd.DataFrame:
+        '''Totals of one of STORE_AGGREGATES over every saved game.'''
+        self._ensure_aggregate(name)
+        return pd.read_sql_query(f'SELECT * FROM "{name}"', self.conn)
+
+    def game_ids(self, table: str = 'pbp') -> List[int]:
+        if not self._columns(table):
+            return []
+        return [row[0] for row in self.conn.execute(f'SELECT DISTINCT game_id FROM "{table}" ORDER BY game_id')]
+
+    def query(self, sql: str, params: tuple = ()) -> pd.DataFrame:
+        '''Run a SQL query and return the result as a DataFrame.'''
+        return pd.read_sql_query(sql, self.conn, params=params)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+#Work queue
+QUEUE_STATES = ['pending', 'leased', 'done', 'failed']
+
+class WorkQueue:
+    '''
+    SQLite job queue of game IDs shared by any number of worker processes, on one or several machines
+    sharing the database file.
+
+    Workers claim games with a time-limited lease. A game whose lease expires (its worker died or hung)
+    can be claimed again by another worker; a game that failed max_attempts times is marked 'failed'
+    instead of being retried. Claims run in an IMMEDIATE transaction, so two workers never hold the same game.
+
+    The database uses SQLite's default rollback journal (journal_mode=DELETE), not WAL: WAL needs every
+    process on the same host (they share the -shm memory map) and doesn't work over a network filesystem.
+    The filesystem must still support file locking (e.g. NFS with working locks). Lease expiry compares
+    time.time() of different machines, so their clocks must be in sync (NTP), and lease_seconds must stay
+    well above the clock skew.
+
+    Parameters
+    ----------
+    path : str
+        Path of the queue database.
+    lease_seconds : float, optional
+        How long a claim is valid, renew() extends it. Keep it well above the clock skew between the
+        machines. The default is 600.
+    max_attempts : int, optional
+        Number of claims of a game before it is given up. The default is 3.
+
+    Example
+    -------
+    >>> WorkQueue('queue.db').seed(fetch_season_game_ids(20232024))
+    >>> # then, in as many processes as wanted:
+    >>> queue_worker('queue.db', 'nhl.db')
+    '''
+
+    def __init__(self, path: str, lease_seconds: float = 600, max_attempts: int = 3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        # Rollback journal, WAL doesn't work across machines
+        self.conn.execute('PRAGMA journal_mode=DELETE')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS jobs (game_id INTEGER PRIMARY KEY, state TEXT NOT NULL DEFAULT 'pending',
+                             worker TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT, updated_at REAL)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, lease_until)')
+
+    def seed(self, game_ids: List[int]) -> int:
+        '''Add games to the queue, games already in it are left untouched. Returns the number added.'''
+        before = self.conn.total_changes
+        self.conn.execute('BEGIN IMMEDIATE')
+        self.conn.executemany("INSERT OR IGNORE INTO jobs (game_id, updated_at) VALUES (?, ?)",
+                              [(int(game_id), time.time()) for game_id in game_ids])
+        self.conn.execute('COMMIT')
+        return self.conn.total_changes - before
+
+    def claim(self, worker: str, n: int = 1) -> List[int]:
+        '''Lease up to n pending (or expired) games to a worker.'''
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            game_ids = [row[0] for row in self.conn.execute(
+                """SELECT game_id FROM jobs WHERE attempts < ? AND (state = 'pending' OR (state = 'leased' AND lease_until < ?))
+                   ORDER BY game_id LIMIT ?""", (self.max_attempts, now, n))]
+            self.conn.executemany("""UPDATE jobs SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, updated_at = ?
+                                     WHERE game_id = ?""", [(worker, now + self.lease_seconds, now, game_id) for game_id in game_ids])
+            # Expired leases that used up their attempts are given up
+            self.conn.execute("""UPDATE jobs SET state = 'failed', error = COALESCE(error, 'Lease expired'), updated_at = ?
+                                 WHERE state = 'leased' AND lease_until < ? AND attempts >= ?""", (now, now, self.max_attempts))
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return game_ids
+
+    def _update_leased(self, sql, params):
+        # Only the worker holding the lease can change a leased game
+        return self.conn.execute(f"{sql} WHERE game_id = ? AND worker = ? AND state = 'leased'", params).rowcount == 1
+
+    def renew(self, game_id: int, worker: str) -> bool:
+        '''Extend a lease. False if the worker no longer holds it.'''
+        now = time.time()
+        return self._update_leased("UPDATE jobs SET lease_until = ?, updated_at = ?", (now + self.lease_seconds, now, int(game_id), worker))
+
+    def complete(self, game_id: int, worker: str) -> bool:
+        '''Mark a leased game done. False if the worker no longer holds the lease.'''
+        return self._update_leased("UPDATE jobs SET state = 'done', lease_until = NULL, error = NULL, updated_at = ?",
+                                   (time.time(), int(game_id), worker))
+
+    def fail(self, game_id: int, worker: str, error: str) -> bool:
+        '''Release a leased game after an error: back to pending, or failed after max_attempts.'''
+        return self._update_leased("""UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                                      lease_until = NULL, error = ?, updated_at = ?""",
+                                   (self.max_attempts, error, time.time(), int(game_id), worker))
+
+    def counts(self) -> Dict:
+        '''Number of games per state (QUEUE_STATES).'''
+        counts = dict.fromkeys(QUEUE_STATES, 0)
+        counts.update(self.conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+        return counts
+
+    def jobs(self, state: Union[str, None] = None) -> pd.DataFrame:
+        '''Jobs table, optionally for one state.'''
+        if state is None:
+            return pd.read_sql_query('SELECT * FROM jobs ORDER BY game_id', self.conn)
+        return pd.read_sql_query('SELECT * FROM jobs WHERE state = ? ORDER BY game_id', self.conn, params=(state,))
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _renew_lease(queue_path, game_id, worker, lease_seconds, stop):
+    # SQLite connections can't be shared between threads, the heartbeat uses its own
+    with WorkQueue(queue_path, lease_seconds) as work_queue:
+        while not stop.wait(lease_seconds / 3):
+            if not work_queue.renew(game_id, worker):
+                return
+
+def queue_worker(queue_path: str, store_path: str, worker: Union[str, None] = None, poll_seconds: float = 0,
+                 lease_seconds: float = 600, max_attempts: int = 3) -> Dict:
+    """
+    Worker loop: claims games from a WorkQueue, scrapes them into a GameStore and reports back, until
+    no game can be claimed.
+
+    Both databases use the rollback journal so workers can run on several machines sharing the files
+    (see WorkQueue for the locking and clock requirements).
+
+    Args:
+      queue_path: Path of the WorkQueue database.
+      store_path: Path of the GameStore database the results are written to.
+      worker: Worker name stored with its leases. Defaulted to None, meaning {hostname}:{pid}.
+      poll_seconds: When nothing can be claimed but other workers still hold leases, wait this long and
+        try again (so games of dead workers get picked up). Defaulted to 0, meaning return right away.
+      lease_seconds: See WorkQueue.
+      max_attempts: See WorkQueue.
+
+    Returns:
+      A dictionary with the 'done' and 'failed' game IDs of this worker.
+    """
+    worker = f"{os.uname().nodename if hasattr(os, 'uname') else 'local'}:{os.getpid()}" if worker is None else worker
+    processed = {'done': [], 'failed': []}
+
+    with WorkQueue(queue_path, lease_seconds, max_attempts) as work_queue, GameStore(store_path, journal_mode='DELETE') as store:
+        while True:
+            game_ids = work_queue.claim(worker)
+            if not game_ids:
+                if poll_seconds and work_queue.counts()['leased']:
+                    time.sleep(poll_seconds)
+                    continue
+                return processed
+
+            game_id = game_ids[0]
+            # Renew the lease while scraping, so only a dead worker lets it expire
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=_renew_lease, args=(queue_path, game_id, worker, lease_seconds, stop), daemon=True)
+            heartbeat.start()
+            try:
+                store.scrape(game_id)
+            except Exception as error:
+                stop.set()
+                heartbeat.join()
+                # False when the lease was lost and another worker owns the game now
+                if work_queue.fail(game_id, worker, repr(error)):
+                    processed['failed'].append(game_id)
+            else:
+                stop.set()
+                heartbeat.join()
+                if work_queue.complete(game_id, worker):
+                    processed['done'].append(game_id)
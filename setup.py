@@ -15,6 +15,11 @@ setup(
         'requests == 2.29.0',
         'beautifulsoup4', # BeautifulSoup should be specified as beautifulsoup4
     ],
+    extras_require={
+        'zstd': ['zstandard'], # Faster compression for PayloadArchive (zlib otherwise)
+        'orjson': ['orjson'], # Faster JSON decoding (json module otherwise)
+        'parquet': ['pyarrow'], # Derived-result cache as parquet (pickle otherwise)
+    },
     python_requires='>=3.6',
     include_package_data=True,
     classifiers=[
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+GAME_ID = 2023020001
+
+def _side_shifts(is_home, abbrev, first_id, change_every, short_handed=()):
+    # One goalie for the whole game and two lines of five skaters changing every change_every seconds.
+    # Shifts starting at a time in short_handed are played with four skaters.
+    goalie = first_id
+    lines = [list(range(first_id + 1, first_id + 6)), list(range(first_id + 6, first_id + 11))]
+    rows = [dict(playerId=goalie, positionCode='G', startTime_s=0, endTime_s=3600)]
+    for n, start in enumerate(range(0, 3600, change_every)):
+        line = lines[n % 2][:4] if start in short_handed else lines[n % 2]
+        for position, player in zip(['C', 'L', 'R', 'D', 'D'], line):
+            rows.append(dict(playerId=player, positionCode=position, startTime_s=start, endTime_s=min(start + change_every, 3600)))
+    df = pd.DataFrame(rows)
+    df['is_home'] = is_home
+    df['abbrev'] = abbrev
+    df['fullName'] = 'Player ' + df['playerId'].astype(str)
+    df['sweaterNumber'] = df['playerId'] % 100
+    df['period'] = df['startTime_s'] // 1200 + 1
+    df['duration_s'] = df['endTime_s'] - df['startTime_s']
+    return df
+
+@pytest.fixture
+def shifts():
+    '''Synthetic shifts of one game, home changing every 60 seconds and away every 45, with two home penalty kills.'''
+    df = pd.concat([_side_shifts(1, 'HOM', 100, 60, short_handed=(600, 2400)), _side_shifts(0, 'AWY', 200, 45)], ignore_index=True)
+    # A zero-length shift, ignored by the on-ice matching
+    df = pd.concat([df, pd.DataFrame([dict(df.iloc[1], startTime_s=900, endTime_s=900, duration_s=0)])], ignore_index=True)
+    df['game_id'] = GAME_ID
+    return df
+
+@pytest.fixture
+def rosters(shifts):
+    return (shifts.drop_duplicates('playerId')[['playerId', 'is_home', 'abbrev', 'fullName', 'sweaterNumber', 'positionCode']]
+                  .reset_index(drop=True))
+
+@pytest.fixture
+def pbp():
+    '''Synthetic play-by-play: faceoffs on line changes, other events inside and on the boundaries of shifts.'''
+    rng = np.random.default_rng(0)
+    times = np.concatenate([[0, 180, 600, 900, 1200, 2400], rng.integers(1, 3600, 200), [45, 60, 90, 120, 3600]])
+    events = np.where(np.isin(times, [0, 180, 600, 900, 1200, 2400]), 'faceoff', rng.choice(['shot-on-goal', 'hit', 'goal'], len(times)))
+    teams = rng.choice(['HOM', 'AWY'], len(times)).astype(object)
+    teams[rng.choice(len(times), 10, replace=False)] = None
+    order = np.argsort(times, kind='stable')
+    return pd.DataFrame({'game_id': GAME_ID, 'elapsedTime': times[order], 'event': events[order], 'event_team': teams[order]},
+                        index=pd.RangeIndex(10, 10 + len(times)))
@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+from max_nhl_scraper.max_nhl_scraper import PayloadArchive
+
+def test_add_get_round_trip(tmp_path):
+    path = str(tmp_path / 'archive')
+    pbp = json.dumps({'id': 2023020001, 'plays': [{'typeDescKey': 'faceoff'}] * 100}).encode()
+    report = b'<html>' + b'x' * 10000 + b'</html>'
+
+    with PayloadArchive(path, mode='a') as archive:
+        archive.add(2023020001, 'pbp', pbp)
+        archive.add(2023020001, 'home_report', report)
+        # Readable before the index is flushed
+        assert archive.get(2023020001, 'pbp') == pbp
+        assert (2023020001, 'home_report') in archive
+        assert (2023020001, 'away_report') not in archive
+        archive.flush()
+        archive.add(2023020002, 'away_report', b'')
+
+    with PayloadArchive(path) as archive:
+        assert archive.get(2023020001, 'pbp') == pbp
+        assert archive.get(2023020001, 'home_report') == report
+        assert archive.get(2023020002, 'away_report') == b''
+        assert archive.pbp_json(2023020001)['id'] == 2023020001
+        assert archive.game_ids() == [2023020001, 2023020002]
+        with pytest.raises(KeyError):
+            archive.get(2023020002, 'pbp')
+        with pytest.raises(ValueError):
+            archive.add(2023020003, 'pbp', pbp)
+
+def test_add_replaces_previous_payload(tmp_path):
+    path = str(tmp_path / 'archive')
+    with PayloadArchive(path, mode='a') as archive:
+        archive.add(2023020001, 'pbp', b'{"v": 1}')
+    with PayloadArchive(path, mode='a') as archive:
+        archive.add(2023020001, 'pbp', b'{"v": 2}')
+        assert archive.get(2023020001, 'pbp') == b'{"v": 2}'
+
+    with PayloadArchive(path) as archive:
+        assert archive.get(2023020001, 'pbp') == b'{"v": 2}'
+        assert len(archive._keys) == 1
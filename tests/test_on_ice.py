@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from max_nhl_scraper.max_nhl_scraper import GameShifts, on_ice_long, process_pbp
+
+def reference_on_ice(pbp, shifts_df, is_home):
+    # The per-event queries of the original process_pbp
+    shifts_df = shifts_df.query("is_home == @is_home").query('duration_s > 0')
+    players_on = {}
+    for index, row in pbp.iterrows():
+        current_time = row['elapsedTime']
+        if pd.isna(row['event_team']):
+            continue
+        if row['event'] == 'faceoff':
+            players_on[index] = shifts_df.query('startTime_s == @current_time')['playerId'].unique().tolist()
+        else:
+            players_on[index] = shifts_df.query('startTime_s < @current_time and endTime_s >= @current_time')['playerId'].unique().tolist()
+    return {index: sorted(players) for index, players in players_on.items() if players}
+
+def long_to_dict(on_ice, place):
+    side = on_ice[on_ice['side'] == place]
+    return {index: sorted(players) for index, players in side.groupby('event_idx')['playerId'].agg(list).items()}
+
+@pytest.mark.parametrize('as_game_shifts', [False, True])
+def test_on_ice_long_matches_process_pbp_queries(pbp, shifts, rosters, as_game_shifts):
+    on_ice = on_ice_long(pbp, GameShifts.from_frame(shifts) if as_game_shifts else shifts, rosters)
+
+    for place, is_home in [('home', 1), ('away', 0)]:
+        assert long_to_dict(on_ice, place) == reference_on_ice(pbp, shifts, is_home)
+
+    side = on_ice[on_ice['side'] == 'home']
+    assert (side.groupby('event_idx')['slot'].agg(list) == side.groupby('event_idx')['slot'].agg(lambda x: list(range(1, len(x) + 1)))).all()
+    assert on_ice['fullName'].notna().all()
+
+def test_on_ice_long_single_side(pbp, shifts):
+    both = on_ice_long(pbp, shifts)
+    away = on_ice_long(pbp, shifts, side='away')
+    pd.testing.assert_frame_equal(away, both[both['side'] == 'away'].reset_index(drop=True))
+
+def test_process_pbp_wide_columns(pbp, shifts, rosters):
+    wide = process_pbp(pbp.copy(), shifts, rosters, is_home=None)
+    expected = reference_on_ice(pbp, shifts, 1)
+
+    ids = wide[[f'home_on_id_{i}' for i in range(1, 8)]].to_numpy()
+    for index, players in expected.items():
+        row = ids[pbp.index.get_loc(index)]
+        assert sorted(row[~np.isnan(row)].astype(int).tolist()) == players
+    assert np.isnan(ids[~pbp.index.isin(list(expected))]).all()
+    assert wide.loc[list(expected)[0], 'home_on_name_1'].startswith('Player ')
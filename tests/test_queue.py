@@ -0,0 +1,64 @@
+import pytest
+
+from max_nhl_scraper import max_nhl_scraper as mns
+from max_nhl_scraper.max_nhl_scraper import WorkQueue
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(mns.time, 'time', lambda: now[0])
+    return now
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    with WorkQueue(str(tmp_path / 'queue.db'), lease_seconds=60, max_attempts=2) as work_queue:
+        yield work_queue
+
+def test_seed_is_idempotent(queue):
+    assert queue.seed([3, 1, 2]) == 3
+    assert queue.seed([2, 4]) == 1
+    assert queue.counts() == {'pending': 4, 'leased': 0, 'done': 0, 'failed': 0}
+
+def test_claim_complete(queue):
+    queue.seed([1, 2, 3])
+    assert queue.claim('a', n=2) == [1, 2]
+    assert queue.claim('b', n=2) == [3]
+    assert queue.claim('c') == []
+
+    assert queue.complete(1, 'a')
+    assert not queue.complete(3, 'a') # Leased by b
+    assert queue.complete(3, 'b')
+    assert queue.counts() == {'pending': 0, 'leased': 1, 'done': 2, 'failed': 0}
+    assert not queue.complete(1, 'a') # Already done
+
+def test_fail_retries_then_gives_up(queue):
+    queue.seed([1])
+    assert queue.claim('a') == [1]
+    assert queue.fail(1, 'a', 'boom')
+    assert queue.jobs('pending')['error'].tolist() == ['boom']
+
+    assert queue.claim('b') == [1]
+    assert not queue.fail(1, 'a', 'stale') # a lost the game to b
+    assert queue.fail(1, 'b', 'boom again')
+    assert queue.counts()['failed'] == 1
+    assert queue.claim('c') == []
+
+def test_lease_expiry(queue, clock):
+    queue.seed([1])
+    assert queue.claim('a') == [1]
+    clock[0] += 30
+    assert queue.claim('b') == []
+    assert queue.renew(1, 'a')
+
+    clock[0] += 59
+    assert queue.claim('b') == [] # Renewed 59 seconds ago, lease still valid
+    clock[0] += 2
+    assert queue.claim('b') == [1]
+    assert not queue.renew(1, 'a')
+    assert not queue.complete(1, 'a')
+
+    # The second expired lease uses up max_attempts
+    clock[0] += 61
+    assert queue.claim('c') == []
+    jobs = queue.jobs()
+    assert jobs['state'].tolist() == ['failed'] and jobs['error'].tolist() == ['Lease expired']
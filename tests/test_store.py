@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from max_nhl_scraper.max_nhl_scraper import STORE_AGGREGATES, GameStore
+
+@pytest.fixture
+def events(pbp, rosters):
+    rng = np.random.default_rng(1)
+    home, away = rosters.query('is_home == 1')['playerId'].to_numpy(), rosters.query('is_home == 0')['playerId'].to_numpy()
+    is_home = (pbp['event_team'] == 'HOM').to_numpy()
+    df = pbp.assign(strength=rng.choice(['5v5', '5v4', '4v5', None], len(pbp)),
+                    event_player1_id=np.where(is_home, rng.choice(home, len(pbp)), rng.choice(away, len(pbp))),
+                    event_player2_id=np.where(is_home, rng.choice(away, len(pbp)), rng.choice(home, len(pbp))).astype(float),
+                    event_player3_id=np.nan)
+    df.loc[df['event_team'].isna(), ['event_player1_id', 'event_player2_id']] = np.nan
+    return df.reset_index(drop=True)
+
+def aggregates(store):
+    return {name: store.aggregate(name).sort_values(keys).reset_index(drop=True) for name, (keys, _) in STORE_AGGREGATES.items()}
+
+def assert_aggregates_equal(left, right):
+    for name in STORE_AGGREGATES:
+        pd.testing.assert_frame_equal(left[name], right[name], check_dtype=False)
+
+def test_save_game_round_trip(tmp_path, events, shifts, rosters):
+    with GameStore(str(tmp_path / 'store.db')) as store:
+        store.save_game(2023020001, pbp=events, shifts=shifts, rosters=rosters)
+        assert store.game_ids() == [2023020001]
+        assert len(store.query('SELECT * FROM pbp')) == len(events)
+        assert len(store.query('SELECT * FROM shifts WHERE game_id = ?', (2023020001,))) == len(shifts)
+
+        team_toi = store.aggregate('team_toi')
+        # Both teams play the whole game: 3600 seconds each, 120 of them shorthanded for the home team
+        assert team_toi.groupby('abbrev')['seconds'].sum().tolist() == [3600, 3600]
+        assert team_toi.query("abbrev == 'HOM' and strength == '4v5'")['seconds'].tolist() == [120]
+        team_events = store.aggregate('team_events')
+        assert team_events['n'].sum() == events['event_team'].notna().sum()
+
+def test_save_game_is_idempotent(tmp_path, events, shifts, rosters):
+    later = events.iloc[:len(events) // 2]
+    with GameStore(str(tmp_path / 'once.db')) as once, GameStore(str(tmp_path / 'twice.db')) as twice:
+        once.save_game(2023020001, pbp=later, shifts=shifts, rosters=rosters)
+        once.save_game(2023020002, pbp=events, shifts=shifts, rosters=rosters)
+
+        twice.save_game(2023020001, pbp=events, shifts=shifts, rosters=rosters)
+        twice.save_game(2023020002, pbp=events, shifts=shifts, rosters=rosters)
+        twice.save_game(2023020002, pbp=events, shifts=shifts, rosters=rosters)
+        # A new version of a game replaces its previous contribution
+        twice.save_game(2023020001, pbp=later, shifts=shifts, rosters=rosters)
+
+        assert_aggregates_equal(aggregates(once), aggregates(twice))
+        assert twice.aggregate('team_toi')['GP'].eq(2).all()
+        assert len(twice.query('SELECT * FROM pbp')) == len(events) + len(later)